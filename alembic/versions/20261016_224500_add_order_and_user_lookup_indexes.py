@@ -0,0 +1,52 @@
+"""Add order and user lookup indexes
+
+Revision ID: 3b9d2f6a41c7
+Revises: e05a76b75d1f
+Create Date: 2026-10-16 22:45:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3b9d2f6a41c7"
+down_revision = "e05a76b75d1f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f("ix_users_auth_token"), "users", ["auth_token"])
+    op.create_index(
+        "ix_sell_orders_user_id_round_id", "sell_orders", ["user_id", "round_id"]
+    )
+    op.create_index(
+        "ix_sell_orders_unassigned",
+        "sell_orders",
+        ["user_id", "number_of_shares"],
+        postgresql_where=sa.text("round_id IS NULL"),
+    )
+    op.create_index(
+        "ix_buy_orders_user_id_round_id", "buy_orders", ["user_id", "round_id"]
+    )
+    op.create_index(
+        "ix_user_requests_user_id_closed_by_user_id",
+        "user_requests",
+        ["user_id", "closed_by_user_id"],
+    )
+    op.create_index(
+        "ix_rounds_is_concluded_end_time", "rounds", ["is_concluded", "end_time"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_rounds_is_concluded_end_time", table_name="rounds")
+    op.drop_index(
+        "ix_user_requests_user_id_closed_by_user_id", table_name="user_requests"
+    )
+    op.drop_index("ix_buy_orders_user_id_round_id", table_name="buy_orders")
+    op.drop_index("ix_sell_orders_unassigned", table_name="sell_orders")
+    op.drop_index("ix_sell_orders_user_id_round_id", table_name="sell_orders")
+    op.drop_index(op.f("ix_users_auth_token"), table_name="users")
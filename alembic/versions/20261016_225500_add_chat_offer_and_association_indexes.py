@@ -0,0 +1,44 @@
+"""Add chat, offer and association indexes
+
+Revision ID: 8c51e0d7a2f4
+Revises: 3b9d2f6a41c7
+Create Date: 2026-10-16 22:55:00.000000
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8c51e0d7a2f4"
+down_revision = "3b9d2f6a41c7"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_chats_chat_room_id_created_at", "chats", ["chat_room_id", "created_at"]),
+    ("ix_offers_chat_room_id_offer_status", "offers", ["chat_room_id", "offer_status"]),
+    ("ix_offer_responses_offer_id", "offer_responses", ["offer_id"]),
+    (
+        "ix_user_chat_room_association_chat_room_id",
+        "user_chat_room_association",
+        ["chat_room_id"],
+    ),
+    (
+        "ix_user_chat_room_association_user_id_role",
+        "user_chat_room_association",
+        ["user_id", "role"],
+    ),
+    ("ix_chat_rooms_match_id", "chat_rooms", ["match_id"]),
+    ("ix_matches_buy_order_id", "matches", ["buy_order_id"]),
+    ("ix_matches_sell_order_id", "matches", ["sell_order_id"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
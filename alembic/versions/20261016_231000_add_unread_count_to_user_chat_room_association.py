@@ -0,0 +1,41 @@
+"""Add unread_count to user_chat_room_association
+
+Revision ID: 5e7a1c93b0d8
+Revises: 8c51e0d7a2f4
+Create Date: 2026-10-16 23:10:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e7a1c93b0d8"
+down_revision = "8c51e0d7a2f4"
+branch_labels = None
+depends_on = None
+
+BACKFILL_UNREAD_COUNTS = """
+UPDATE user_chat_room_association AS a SET unread_count = (
+    SELECT count(c.id) FROM chats AS c
+    WHERE c.chat_room_id = a.chat_room_id
+    AND c.author_id != a.user_id
+    AND (
+        a.last_read_id IS NULL
+        OR c.created_at > (SELECT created_at FROM chats WHERE id = a.last_read_id)
+    )
+)
+"""
+
+
+def upgrade():
+    op.add_column(
+        "user_chat_room_association",
+        sa.Column("unread_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.execute(BACKFILL_UNREAD_COUNTS)
+
+
+def downgrade():
+    op.drop_column("user_chat_room_association", "unread_count")
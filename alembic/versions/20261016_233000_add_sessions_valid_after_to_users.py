@@ -0,0 +1,28 @@
+"""Add sessions_valid_after to users
+
+Revision ID: 7d2f4b8e1a36
+Revises: 5e7a1c93b0d8
+Create Date: 2026-10-16 23:30:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7d2f4b8e1a36"
+down_revision = "5e7a1c93b0d8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "users",
+        sa.Column("sessions_valid_after", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column("users", "sessions_valid_after")
@@ -0,0 +1,2 @@
+#!/usr/bin/env bash
+env PYTHONPATH=. poetry run python -m benchmarks.match "$@"
@@ -0,0 +1,58 @@
+"""
+Benchmarks the matching algorithm under pytest-benchmark.
+
+Not collected by default. Run with
+`env PYTHONPATH=. poetry run pytest benchmarks/bench_match.py`.
+"""
+import pytest
+
+from benchmarks.match import run_distribution, run_first_matching
+from benchmarks.order_books import generate_order_book
+from src.match import SOLVERS, match_buyers_and_sellers
+
+# 50000 orders take minutes per round with networkx, see ./bench.sh for those
+PYTEST_ORDER_BOOK_SIZES = [100, 1000, 10000]
+
+
+@pytest.fixture(scope="module", params=PYTEST_ORDER_BOOK_SIZES)
+def order_book(request):
+    return generate_order_book(request.param)
+
+
+@pytest.mark.parametrize("solver", sorted(SOLVERS))
+def test_first_matching(benchmark, order_book, solver):
+    buy_orders, sell_orders, banned_user_matches = order_book
+    if solver == "networkx" and len(buy_orders) > 1000:
+        pytest.skip("networkx is too slow on large order books")
+
+    matches = benchmark(
+        run_first_matching, buy_orders, sell_orders, banned_user_matches, solver, None
+    )
+    benchmark.extra_info["matches"] = len(matches)
+
+
+def test_distribution(benchmark, order_book):
+    buy_orders, sell_orders, banned_user_matches = order_book
+    first_matches = run_first_matching(
+        buy_orders, sell_orders, banned_user_matches, "dense_assignment", None
+    )
+
+    # distribute_remaining_buyers mutates the remaining buy orders it is given, but
+    # run_distribution builds a new list of them on every call
+    matches = benchmark(
+        run_distribution, buy_orders, sell_orders, banned_user_matches, first_matches
+    )
+    benchmark.extra_info["matches"] = len(matches)
+
+
+def test_match_buyers_and_sellers(benchmark, order_book):
+    buy_orders, sell_orders, banned_user_matches = order_book
+
+    matches = benchmark(
+        match_buyers_and_sellers,
+        buy_orders,
+        sell_orders,
+        banned_user_matches,
+        solver="dense_assignment",
+    )
+    benchmark.extra_info["matches"] = len(matches)
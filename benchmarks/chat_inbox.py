@@ -0,0 +1,247 @@
+"""
+Benchmarks loading the chat inbox of a user, with and without the chat indexes.
+
+Creates, seeds and then drops every table of the test database, so it only runs
+with ACQUITY_ENV=TEST, e.g.
+`env ACQUITY_ENV=TEST PYTHONPATH=. poetry run python -m benchmarks.chat_inbox`.
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from src.config import ACQUITY_ENV, APP_CONFIG
+from src.database import (
+    Base,
+    BuyOrder,
+    Chat,
+    ChatRoom,
+    Match,
+    Offer,
+    OfferResponse,
+    Round,
+    Security,
+    SellOrder,
+    User,
+    UserChatRoomAssociation,
+    engine,
+    session_scope,
+)
+from src.services import ChatService
+
+CHAT_ROOM_COUNTS = [100, 1000, 10000]
+
+# indexes on the tables that the inbox reads, see the chat indexes migration
+CHAT_INDEXES = [
+    "ix_chats_chat_room_id_created_at",
+    "ix_offers_chat_room_id_offer_status",
+    "ix_offer_responses_offer_id",
+    "ix_user_chat_room_association_chat_room_id",
+    "ix_user_chat_room_association_user_id_role",
+    "ix_chat_rooms_match_id",
+    "ix_matches_buy_order_id",
+    "ix_matches_sell_order_id",
+]
+
+
+def _id():
+    return str(uuid.uuid4())
+
+
+def seed_chat_rooms(number_of_chat_rooms, chats_per_room, rooms_per_user, seed=0):
+    """
+    Seeds chat rooms between random pairs of users, each with chats_per_room chats,
+    a rejected offer and a pending offer. Every user is in about rooms_per_user
+    rooms, and has read about half of the chats of each room.
+
+    Returns:
+    The ids of the users.
+    """
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=30)
+    number_of_users = max(2, 2 * number_of_chat_rooms // rooms_per_user)
+
+    users = [
+        {
+            "id": _id(),
+            "email": f"a{i}@a",
+            "provider": "linkedin",
+            "full_name": f"a{i}",
+            "provider_user_id": f"abcdef{i}",
+            "can_buy": True,
+            "can_sell": True,
+        }
+        for i in range(number_of_users)
+    ]
+    security_id = _id()
+    round_id = _id()
+    rows = {
+        table: []
+        for table in [
+            BuyOrder,
+            SellOrder,
+            Match,
+            ChatRoom,
+            UserChatRoomAssociation,
+            Chat,
+            Offer,
+            OfferResponse,
+        ]
+    }
+
+    for i in range(number_of_chat_rooms):
+        buyer, seller = rng.sample(users, 2)
+        order = {"security_id": security_id, "round_id": round_id, "price": 10}
+        buy_order_id, sell_order_id = _id(), _id()
+        rows[BuyOrder].append(
+            {**order, "id": buy_order_id, "user_id": buyer["id"], "number_of_shares": 1}
+        )
+        rows[SellOrder].append(
+            {
+                **order,
+                "id": sell_order_id,
+                "user_id": seller["id"],
+                "number_of_shares": 1,
+            }
+        )
+        match_id = _id()
+        rows[Match].append(
+            {
+                "id": match_id,
+                "buy_order_id": buy_order_id,
+                "sell_order_id": sell_order_id,
+            }
+        )
+        chat_room_id = _id()
+        rows[ChatRoom].append(
+            {"id": chat_room_id, "match_id": match_id, "friendly_name": f"room{i}"}
+        )
+
+        chats = [
+            {
+                "id": _id(),
+                "chat_room_id": chat_room_id,
+                "message": f"message{j}",
+                "author_id": (buyer, seller)[j % 2]["id"],
+                "created_at": start + timedelta(minutes=i + j),
+            }
+            for j in range(chats_per_room)
+        ]
+        rows[Chat].extend(chats)
+        last_read_id = chats[len(chats) // 2]["id"] if chats else None
+        for user, role in [(buyer, "BUYER"), (seller, "SELLER")]:
+            rows[UserChatRoomAssociation].append(
+                {
+                    "id": _id(),
+                    "user_id": user["id"],
+                    "chat_room_id": chat_room_id,
+                    "role": role,
+                    "last_read_id": last_read_id,
+                }
+            )
+
+        for offer_status in ["REJECTED", "PENDING"]:
+            offer_id = _id()
+            rows[Offer].append(
+                {
+                    "id": offer_id,
+                    "chat_room_id": chat_room_id,
+                    "price": 10,
+                    "number_of_shares": 1,
+                    "author_id": buyer["id"],
+                    "offer_status": offer_status,
+                }
+            )
+            if offer_status == "REJECTED":
+                rows[OfferResponse].append({"id": _id(), "offer_id": offer_id})
+
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), users)
+        connection.execute(
+            Security.__table__.insert(), [{"id": security_id, "name": "a"}]
+        )
+        connection.execute(
+            Round.__table__.insert(),
+            [{"id": round_id, "end_time": datetime.now(), "is_concluded": True}],
+        )
+        for table, table_rows in rows.items():
+            if table_rows:
+                connection.execute(table.__table__.insert(), table_rows)
+        connection.execute("ANALYZE")
+
+    return [user["id"] for user in users]
+
+
+def measure_inbox(user_ids, repeat):
+    """
+    Returns the median wall time, in seconds, of loading the inboxes of user_ids.
+    """
+    chat_service = ChatService(APP_CONFIG)
+    wall_times = []
+    for _ in range(repeat):
+        for user_id in user_ids:
+            start = time.perf_counter()
+            chat_service.get_chats_by_user_id(
+                user_id=user_id, as_buyer=True, as_seller=True
+            )
+            wall_times.append(time.perf_counter() - start)
+    return statistics.median(wall_times)
+
+
+def measure_inbox_without_indexes(user_ids, repeat):
+    """
+    Same as measure_inbox, with CHAT_INDEXES dropped in a transaction that is rolled
+    back afterwards. The services share that transaction, see session_scope.
+    """
+    with session_scope() as session:
+        for index in CHAT_INDEXES:
+            session.execute(f"DROP INDEX {index}")
+        session.execute("ANALYZE")
+        try:
+            return measure_inbox(user_ids, repeat)
+        finally:
+            session.rollback()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--chat-rooms", type=int, nargs="+", default=CHAT_ROOM_COUNTS, metavar="N"
+    )
+    parser.add_argument("--chats-per-room", type=int, default=20)
+    parser.add_argument("--rooms-per-user", type=int, default=10)
+    parser.add_argument("--users", type=int, default=5, help="inboxes to load")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if ACQUITY_ENV != "TEST":
+        parser.error("drops every table of the database, run with ACQUITY_ENV=TEST")
+
+    print(f"{'rooms':>8} {'without indexes (ms)':>21} {'with indexes (ms)':>18}")
+    for number_of_chat_rooms in args.chat_rooms:
+        Base.metadata.create_all(engine)
+        try:
+            user_ids = seed_chat_rooms(
+                number_of_chat_rooms,
+                args.chats_per_room,
+                args.rooms_per_user,
+                seed=args.seed,
+            )[: args.users]
+            # warms up the caches of the database
+            measure_inbox(user_ids, 1)
+            without_indexes = measure_inbox_without_indexes(user_ids, args.repeat)
+            with_indexes = measure_inbox(user_ids, args.repeat)
+        finally:
+            Base.metadata.drop_all(engine)
+
+        print(
+            f"{number_of_chat_rooms:>8} {without_indexes * 1000:>21.1f} "
+            f"{with_indexes * 1000:>18.1f}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmarks the phases of the matching algorithm on generated order books.
+
+Run with `./bench.sh`, e.g. `./bench.sh --sizes 100 1000 --solver networkx`.
+"""
+import argparse
+import time
+import tracemalloc
+from copy import deepcopy
+
+from benchmarks.order_books import ORDER_BOOK_SIZES, generate_order_book
+from src.match import (
+    SOLVERS,
+    distribute_remaining_buyers,
+    match_seller_with_nearest_buyer,
+)
+
+
+def run_first_matching(
+    buy_orders, sell_orders, banned_user_matches, solver, max_edges_per_order
+):
+    max_number_of_shares = max(o["number_of_shares"] for o in buy_orders + sell_orders)
+    return match_seller_with_nearest_buyer(
+        buy_orders,
+        sell_orders,
+        banned_user_matches,
+        max_number_of_shares,
+        solver=solver,
+        max_edges_per_order=max_edges_per_order,
+    )
+
+
+def run_distribution(buy_orders, sell_orders, banned_user_matches, first_matches):
+    matched_buy_order_ids = {buy_order_id for buy_order_id, _ in first_matches}
+    remaining_buy_orders = [
+        o for o in buy_orders if o["id"] not in matched_buy_order_ids
+    ]
+    return distribute_remaining_buyers(
+        remaining_buy_orders, sell_orders, banned_user_matches
+    )
+
+
+def measure(function, *args):
+    """
+    Runs function twice on copies of args: once for the wall time, and once under
+    tracemalloc for the peak memory, since tracing slows down allocations.
+
+    Returns:
+    (result, wall time in seconds, peak traced memory in bytes)
+    """
+    arguments = deepcopy(args)
+    start = time.perf_counter()
+    result = function(*arguments)
+    wall_time = time.perf_counter() - start
+
+    arguments = deepcopy(args)
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, wall_time, peak_memory
+
+
+def matched_volume(buy_orders, sell_orders, matches):
+    buy_order_shares = {o["id"]: o["number_of_shares"] for o in buy_orders}
+    sell_order_shares = {o["id"]: o["number_of_shares"] for o in sell_orders}
+    return sum(
+        min(buy_order_shares[buy_order_id], sell_order_shares[sell_order_id])
+        for buy_order_id, sell_order_id in matches
+    )
+
+
+def benchmark_order_book(
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    solver="networkx",
+    max_edges_per_order=None,
+):
+    """
+    Returns:
+    A list with a dict for every phase of match_buyers_and_sellers, e.g.
+    [{'phase': 'first_matching', 'wall_time': 0.1, 'peak_memory': 1024,
+      'matches': 10, 'matched_volume': 1000.0}, ...]
+    """
+    first_matches, wall_time, peak_memory = measure(
+        run_first_matching,
+        buy_orders,
+        sell_orders,
+        banned_user_matches,
+        solver,
+        max_edges_per_order,
+    )
+    results = [
+        {
+            "phase": "first_matching",
+            "wall_time": wall_time,
+            "peak_memory": peak_memory,
+            "matches": len(first_matches),
+            "matched_volume": matched_volume(buy_orders, sell_orders, first_matches),
+        }
+    ]
+
+    distributed_matches, wall_time, peak_memory = measure(
+        run_distribution, buy_orders, sell_orders, banned_user_matches, first_matches
+    )
+    results.append(
+        {
+            "phase": "distribution",
+            "wall_time": wall_time,
+            "peak_memory": peak_memory,
+            "matches": len(distributed_matches),
+            "matched_volume": matched_volume(
+                buy_orders, sell_orders, distributed_matches
+            ),
+        }
+    )
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=ORDER_BOOK_SIZES, metavar="N"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--solver", choices=sorted(SOLVERS), default="networkx")
+    parser.add_argument("--max-edges-per-order", type=int, default=None)
+    parser.add_argument("--banned-pairs-per-buyer", type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'orders':>8} {'phase':<16} {'time (s)':>10} {'peak (MiB)':>11} "
+        f"{'matches':>8} {'volume':>14}"
+    )
+    for size in args.sizes:
+        buy_orders, sell_orders, banned_user_matches = generate_order_book(
+            size, seed=args.seed, banned_pairs_per_buyer=args.banned_pairs_per_buyer
+        )
+        for result in benchmark_order_book(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            solver=args.solver,
+            max_edges_per_order=args.max_edges_per_order,
+        ):
+            print(
+                f"{size:>8} {result['phase']:<16} {result['wall_time']:>10.3f} "
+                f"{result['peak_memory'] / 2 ** 20:>11.1f} {result['matches']:>8} "
+                f"{result['matched_volume']:>14.0f}",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import random
+
+from src.match import double_sell_orders
+
+ORDER_BOOK_SIZES = [100, 1000, 10000, 50000]
+
+
+def generate_order_book(
+    number_of_orders,
+    seed=0,
+    market_price=10.0,
+    price_spread=0.05,
+    tick_size=0.05,
+    lot_size=100,
+    share_size_skew=1.5,
+    max_lots=1000,
+    orders_per_user=2,
+    banned_pairs_per_buyer=0.5,
+    security_id="security",
+):
+    """
+    Generates a random but reproducible order book for a single security, in the shape
+    that MatchService passes to match_buyers_and_sellers.
+
+    Params:
+    number_of_orders: number of buy and sell orders, split evenly, before doubling.
+    seed: seed of the random generator.
+    market_price: the Security.market_price that prices are centred on.
+    price_spread: standard deviation of the prices, relative to market_price. Buyers
+    bid slightly above and sellers ask slightly below market_price.
+    tick_size: prices are rounded to multiples of this, which gives price levels.
+    lot_size: number of shares are multiples of this.
+    share_size_skew: Pareto shape of the number of lots. Smaller values give more
+    very large orders.
+    max_lots: largest number of lots in one order.
+    orders_per_user: average number of orders placed by a user.
+    banned_pairs_per_buyer: average number of sellers a buyer is banned with.
+    security_id: security_id of every order.
+
+    Returns:
+    (buy_orders, sell_orders, banned_user_matches), where sell orders of sellers with a
+    single sell order are doubled by double_sell_orders, like MatchService does.
+    """
+    rng = random.Random(seed)
+
+    number_of_buy_orders = number_of_orders // 2
+    number_of_sell_orders = number_of_orders - number_of_buy_orders
+    buyers = [
+        f"buyer{i}" for i in range(max(1, number_of_buy_orders // orders_per_user))
+    ]
+    sellers = [
+        f"seller{i}" for i in range(max(1, number_of_sell_orders // orders_per_user))
+    ]
+
+    def random_price(mean):
+        price = rng.gauss(mean, market_price * price_spread)
+        return max(tick_size, round(price / tick_size) * tick_size)
+
+    def random_number_of_shares():
+        lots = min(max_lots, int(rng.paretovariate(share_size_skew)))
+        return float(lots * lot_size)
+
+    def random_orders(prefix, number_of_orders, users, mean_price):
+        return [
+            {
+                "id": f"{prefix}{i}",
+                "user_id": rng.choice(users),
+                "security_id": security_id,
+                "number_of_shares": random_number_of_shares(),
+                "price": random_price(mean_price),
+            }
+            for i in range(number_of_orders)
+        ]
+
+    buy_orders = random_orders(
+        "buy", number_of_buy_orders, buyers, market_price * (1 + price_spread / 2)
+    )
+    sell_orders = random_orders(
+        "sell", number_of_sell_orders, sellers, market_price * (1 - price_spread / 2)
+    )
+    banned_user_matches = {
+        (rng.choice(buyers), rng.choice(sellers))
+        for _ in range(int(len(buyers) * banned_pairs_per_buyer))
+    }
+
+    return buy_orders, double_sell_orders(sell_orders), banned_user_matches
@@ -1,7 +1,7 @@
 from functools import wraps
 
 from sanic import Blueprint
-from sanic.response import json
+from sanic.response import HTTPResponse, json
 
 from src.exceptions import InvalidAuthorizationTokenException, ResourceNotOwnedException
 from src.utils import expects_json_object
@@ -17,10 +17,7 @@ def auth_required(f):
         if header is None or not header.startswith(PREFIX):
             raise InvalidAuthorizationTokenException("Invalid Authorization Bearer")
         token = header[len(PREFIX) :]
-        linkedin_user = request.app.linkedin_login.get_linkedin_user(token=token)
-        user = request.app.user_service.get_user_by_linkedin_id(
-            provider_user_id=linkedin_user.get("provider_user_id")
-        )
+        user = await request.app.linkedin_login.get_authenticated_user(token=token)
         if user is None:
             raise ResourceNotOwnedException("User not found")
 
@@ -30,13 +27,22 @@ def auth_required(f):
     return decorated_function
 
 
+def _number_arg(request, name, type):
+    """
+    Returns the query argument `name` as a `type`, or as it is if it is not one, for
+    the services to reject.
+    """
+    value = request.args.get(name)
+    try:
+        return value if value is None else type(value)
+    except ValueError:
+        return value
+
+
 @blueprint.get("/auth/me")
 @auth_required
 async def user_info(request, user):
-    user = request.app.user_service.get_user_by_linkedin_id(
-        provider_user_id=user.get("provider_user_id")
-    )
-    return json({"me": user})
+    return json({"me": await request.app.user_service.get_user_by_id(id=user["id"])})
 
 
 @blueprint.get("/")
@@ -48,7 +54,7 @@ async def root(request):
 @auth_required
 async def get_sell_orders_by_user_in_current_round(request, user):
     return json(
-        request.app.sell_order_service.get_orders_by_user_in_current_round(
+        await request.app.sell_order_service.get_orders_by_user_in_current_round(
             user_id=user["id"]
         )
     )
@@ -58,7 +64,7 @@ async def get_sell_orders_by_user_in_current_round(request, user):
 @auth_required
 async def get_sell_order_by_id(request, user, id):
     return json(
-        request.app.sell_order_service.get_order_by_id(id=id, user_id=user["id"])
+        await request.app.sell_order_service.get_order_by_id(id=id, user_id=user["id"])
     )
 
 
@@ -67,7 +73,7 @@ async def get_sell_order_by_id(request, user, id):
 @expects_json_object
 async def create_sell_order(request, user):
     return json(
-        request.app.sell_order_service.create_order(
+        await request.app.sell_order_service.create_order(
             **request.json, user_id=user["id"], scheduler=request.app.scheduler
         )
     )
@@ -78,7 +84,7 @@ async def create_sell_order(request, user):
 @expects_json_object
 async def edit_sell_order(request, user, id):
     return json(
-        request.app.sell_order_service.edit_order(
+        await request.app.sell_order_service.edit_order(
             **request.json, id=id, subject_id=user["id"]
         )
     )
@@ -88,7 +94,7 @@ async def edit_sell_order(request, user, id):
 @auth_required
 async def delete_sell_order(request, user, id):
     return json(
-        request.app.sell_order_service.delete_order(id=id, subject_id=user["id"])
+        await request.app.sell_order_service.delete_order(id=id, subject_id=user["id"])
     )
 
 
@@ -96,7 +102,7 @@ async def delete_sell_order(request, user, id):
 @auth_required
 async def get_buy_orders_by_user_in_current_round(request, user):
     return json(
-        request.app.buy_order_service.get_orders_by_user_in_current_round(
+        await request.app.buy_order_service.get_orders_by_user_in_current_round(
             user_id=user["id"]
         )
     )
@@ -106,7 +112,7 @@ async def get_buy_orders_by_user_in_current_round(request, user):
 @auth_required
 async def get_buy_order_by_id(request, user, id):
     return json(
-        request.app.buy_order_service.get_order_by_id(id=id, user_id=user["id"])
+        await request.app.buy_order_service.get_order_by_id(id=id, user_id=user["id"])
     )
 
 
@@ -115,7 +121,9 @@ async def get_buy_order_by_id(request, user, id):
 @expects_json_object
 async def create_buy_order(request, user):
     return json(
-        request.app.buy_order_service.create_order(**request.json, user_id=user["id"])
+        await request.app.buy_order_service.create_order(
+            **request.json, user_id=user["id"]
+        )
     )
 
 
@@ -124,7 +132,7 @@ async def create_buy_order(request, user):
 @expects_json_object
 async def edit_buy_order(request, user, id):
     return json(
-        request.app.buy_order_service.edit_order(
+        await request.app.buy_order_service.edit_order(
             **request.json, id=id, subject_id=user["id"]
         )
     )
@@ -134,13 +142,13 @@ async def edit_buy_order(request, user, id):
 @auth_required
 async def delete_buy_order(request, user, id):
     return json(
-        request.app.buy_order_service.delete_order(id=id, subject_id=user["id"])
+        await request.app.buy_order_service.delete_order(id=id, subject_id=user["id"])
     )
 
 
 @blueprint.get("/security/")
 async def get_all_securities(request):
-    return json(request.app.security_service.get_all())
+    return json(await request.app.security_service.get_all())
 
 
 @blueprint.patch("/security/<id>")
@@ -148,7 +156,7 @@ async def get_all_securities(request):
 @auth_required
 async def edit_security_market_price(request, user, id):
     return json(
-        request.app.security_service.edit_market_price(
+        await request.app.security_service.edit_market_price(
             **request.json, id=id, subject_id=user["id"]
         )
     )
@@ -156,43 +164,54 @@ async def edit_security_market_price(request, user, id):
 
 @blueprint.get("/round/")
 async def get_all_rounds(request):
-    return json(request.app.round_service.get_all())
+    return json(await request.app.round_service.get_all())
 
 
 @blueprint.get("/round/active")
 async def get_active_round(request):
-    return json(request.app.round_service.get_active())
+    return json(await request.app.round_service.get_active())
 
 
 @blueprint.get("/round/previous/statistics/<security_id>")
 async def get_previous_round(request, security_id):
     return json(
-        request.app.round_service.get_previous_round_statistics(security_id=security_id)
+        await request.app.round_service.get_previous_round_statistics(
+            security_id=security_id
+        )
     )
 
 
 @blueprint.get("/auth/linkedin")
 async def linkedin_auth(request):
-    return json(request.app.linkedin_login.get_auth_url(**request.args))
+    return json(await request.app.linkedin_login.get_auth_url(**request.args))
 
 
 @blueprint.post("/auth/linkedin")
 @expects_json_object
 async def linkedin_auth_callback(request):
-    return json(request.app.linkedin_login.authenticate(**request.json))
+    return json(await request.app.linkedin_login.authenticate(**request.json))
+
+
+@blueprint.post("/auth/logout")
+@auth_required
+async def logout(request, user):
+    await request.app.linkedin_login.logout(user_id=user["id"])
+    return json({})
 
 
 @blueprint.get("/requests/")
 @auth_required
 async def get_requests(request, user):
-    return json(request.app.user_request_service.get_requests(subject_id=user["id"]))
+    return json(
+        await request.app.user_request_service.get_requests(subject_id=user["id"])
+    )
 
 
 @blueprint.post("/requests/<id>")
 @auth_required
 async def approve_request(request, user, id):
     return json(
-        request.app.user_request_service.approve_request(
+        await request.app.user_request_service.approve_request(
             request_id=id, subject_id=user["id"]
         )
     )
@@ -202,7 +221,7 @@ async def approve_request(request, user, id):
 @auth_required
 async def reject_request(request, user, id):
     return json(
-        request.app.user_request_service.reject_request(
+        await request.app.user_request_service.reject_request(
             request_id=id, subject_id=user["id"]
         )
     )
@@ -212,8 +231,33 @@ async def reject_request(request, user, id):
 @auth_required
 async def get_chats(request, user):
     types = request.args.get("type") or []
+    as_buyer, as_seller = "buyer" in types, "seller" in types
+    # taken before the chats are loaded, so that it is never newer than them
+    etag = await request.app.chat_service.get_chats_etag(
+        user_id=user["id"], as_buyer=as_buyer, as_seller=as_seller
+    )
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        return HTTPResponse(status=304, headers={"ETag": etag})
+
+    return json(
+        await request.app.chat_service.get_chats_by_user_id(
+            user_id=user["id"],
+            as_buyer=as_buyer,
+            as_seller=as_seller,
+            since=_number_arg(request, "since", float),
+        ),
+        headers={"ETag": etag},
+    )
+
+
+@blueprint.get("/chats/<chat_room_id>/events")
+@auth_required
+async def get_chat_events(request, user, chat_room_id):
     return json(
-        request.app.chat_service.get_chats_by_user_id(
-            user_id=user["id"], as_buyer="buyer" in types, as_seller="seller" in types
+        await request.app.chat_service.get_chat_events(
+            user_id=user["id"],
+            chat_room_id=chat_room_id,
+            before=request.args.get("before"),
+            limit=_number_arg(request, "limit", int),
         )
     )
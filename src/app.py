@@ -12,9 +12,12 @@ from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from src.api import blueprint
 from src.chat_service import ChatSocketService
 from src.config import APP_CONFIG
+from src.database import AsyncService, listen
 from src.exceptions import AcquityException
-from src.scheduler import scheduler
+from src.scheduler import scheduler, start_on_loop
 from src.services import (
+    ACTIVE_ROUND_CHANNEL,
+    AUTHENTICATED_USERS_CHANNEL,
     BannedPairService,
     BuyOrderService,
     ChatRoomService,
@@ -26,6 +29,9 @@ from src.services import (
     SellOrderService,
     UserRequestService,
     UserService,
+    active_round_cache,
+    authenticated_users,
+    repair_unread_counts,
 )
 from src.utils import AcquityJson
 
@@ -44,6 +50,9 @@ if APP_CONFIG["SENTRY_ENABLE"]:
         before_send=sentry_before_send,
     )
 
+if not APP_CONFIG["ACQUITY_SESSION_SECRET"]:
+    raise RuntimeError("ACQUITY_SESSION_SECRET is not set")
+
 app = Sanic(load_env=False)
 app.config.update(APP_CONFIG)
 
@@ -53,17 +62,17 @@ sio = socketio.AsyncServer(
 sio.attach(app)
 sio.register_namespace(ChatSocketService("/v1/chat", app.config))
 
-app.user_service = UserService(app.config)
-app.sell_order_service = SellOrderService(app.config)
-app.buy_order_service = BuyOrderService(app.config)
-app.security_service = SecurityService(app.config)
-app.round_service = RoundService(app.config)
+app.user_service = AsyncService(UserService(app.config))
+app.sell_order_service = AsyncService(SellOrderService(app.config))
+app.buy_order_service = AsyncService(BuyOrderService(app.config))
+app.security_service = AsyncService(SecurityService(app.config))
+app.round_service = AsyncService(RoundService(app.config))
 app.match_service = MatchService(app.config)
-app.banned_pair_service = BannedPairService(app.config)
-app.chat_room_service = ChatRoomService(app.config)
-app.chat_service = ChatService(app.config)
-app.linkedin_login = LinkedInLogin(app.config)
-app.user_request_service = UserRequestService(app.config)
+app.banned_pair_service = AsyncService(BannedPairService(app.config))
+app.chat_room_service = AsyncService(ChatRoomService(app.config))
+app.chat_service = AsyncService(ChatService(app.config))
+app.linkedin_login = AsyncService(LinkedInLogin(app.config))
+app.user_request_service = AsyncService(UserRequestService(app.config))
 
 initialize_cors(app)
 
@@ -90,9 +99,19 @@ app.error_handler.add(Exception, error_handler)
 
 @app.listener("after_server_start")
 async def start_scheduler(app, loop):
-    scheduler.configure(event_loop=loop)
     app.scheduler = scheduler
-    scheduler.start()
+    start_on_loop(loop)
+    listen(ACTIVE_ROUND_CHANNEL, active_round_cache.clear)
+    listen(AUTHENTICATED_USERS_CHANNEL, authenticated_users.clear)
+    # not through AsyncService, so that it waits for connections like other jobs; the
+    # id keeps a single copy in the job store across restarts and workers
+    app.scheduler.add_job(
+        repair_unread_counts,
+        "interval",
+        seconds=app.config["ACQUITY_UNREAD_COUNT_REPAIR_INTERVAL"],
+        id="repair_unread_counts",
+        replace_existing=True,
+    )
 
 
 if __name__ == "__main__":
@@ -1,6 +1,18 @@
+import asyncio
+import os
+import select
+import sys
+import threading
+import time
 import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import partial, wraps
 
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from sqlalchemy import (
     Boolean,
     Column,
@@ -8,17 +20,23 @@ from sqlalchemy import (
     Enum,
     Float,
     ForeignKey,
+    Index,
+    Integer,
     String,
     Text,
     UniqueConstraint,
     create_engine,
+    exc,
     func,
+    or_,
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import aliased, object_session, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from src.config import APP_CONFIG
+from src.exceptions import DatabaseUnavailableException
 from src.utils import generate_friendly_name
 
 _base = declarative_base()
@@ -37,7 +55,11 @@ class Base(_base):
     def additional_things_to_dict(self):
         return {}
 
-    def asdict(self):
+    def asdict(self, **additional_things):
+        """
+        additional_things: if set, used instead of additional_things_to_dict, e.g. when
+        they are loaded for many objects at once.
+        """
         d = {}
         columns = self.__table__.columns.keys()
 
@@ -49,7 +71,9 @@ class Base(_base):
             else:
                 d[col] = item
 
-        for key, value in self.additional_things_to_dict.items():
+        if not additional_things:
+            additional_things = self.additional_things_to_dict
+        for key, value in additional_things.items():
             d[key] = value
 
         return d
@@ -66,7 +90,9 @@ class User(Base):
     can_sell = Column(Boolean, nullable=False, server_default="f")
     is_committee = Column(Boolean, nullable=False, server_default="f")
     provider_user_id = Column(String, nullable=False, unique=True)
-    auth_token = Column(String)
+    auth_token = Column(String, index=True)
+    # session tokens issued until then are no longer valid, see LinkedInLogin.logout
+    sessions_valid_after = Column(DateTime(timezone=True))
 
     sell_orders = relationship("SellOrder", back_populates="user")
     buy_orders = relationship("BuyOrder", back_populates="user")
@@ -79,23 +105,61 @@ class User(Base):
 
     @property
     def additional_things_to_dict(self):
-        d = {"auth_token": None}
+        session = object_session(self)
+        if session is not None:
+            return {"auth_token": None, **capability_statuses(session, [self])[0]}
 
         with session_scope() as session:
-            req = session.query(UserRequest).filter_by(
-                user_id=str(self.id), closed_by_user_id=None
+            return {"auth_token": None, **capability_statuses(session, [self])[0]}
+
+    @staticmethod
+    def asdicts(session, users):
+        """
+        Same as [user.asdict() for user in users], with a single query for the
+        capability statuses of all the users.
+        """
+        return [
+            user.asdict(auth_token=None, **statuses)
+            for user, statuses in zip(users, capability_statuses(session, users))
+        ]
+
+
+def capability_statuses(session, users):
+    """
+    Computes the can_buy and can_sell statuses of users with one query on their open
+    user requests: "YES" if the user is allowed to, "UNAPPROVED" if they have an open
+    request for it, and "NO" otherwise.
+
+    Returns:
+    A list with {'can_buy': status, 'can_sell': status} for every user.
+    """
+    user_ids = {str(user.id) for user in users}
+    open_requests = set()
+    if len(user_ids) > 0:
+        open_requests = set(
+            session.query(UserRequest.user_id, UserRequest.is_buy)
+            .filter(
+                UserRequest.user_id.in_(user_ids),
+                UserRequest.closed_by_user_id == None,
             )
+            .group_by(UserRequest.user_id, UserRequest.is_buy)
+            .all()
+        )
 
-            for col in ["can_buy", "can_sell"]:
-                if getattr(self, col):
-                    item = "YES"
-                elif req.filter_by(is_buy=col == "can_buy").count() > 0:
-                    item = "UNAPPROVED"
-                else:
-                    item = "NO"
-                d[col] = item
+    statuses = []
+    for user in users:
+        d = {}
+        for col in ["can_buy", "can_sell"]:
+            if getattr(user, col):
+                item = "YES"
+            elif (str(user.id), col == "can_buy") in open_requests:
+                item = "UNAPPROVED"
+            else:
+                item = "NO"
+            d[col] = item
+        statuses.append(d)
 
-        return d
+    return statuses
 
 
 class Security(Base):
@@ -128,6 +192,17 @@ class SellOrder(Base):
     security = relationship("Security", back_populates="sell_orders", lazy="joined")
     round = relationship("Round", back_populates="sell_orders")
 
+    __table_args__ = (
+        Index("ix_sell_orders_user_id_round_id", "user_id", "round_id"),
+        # sell orders waiting for the next round, see RoundService.should_round_start
+        Index(
+            "ix_sell_orders_unassigned",
+            "user_id",
+            "number_of_shares",
+            postgresql_where=round_id.is_(None),
+        ),
+    )
+
 
 class BuyOrder(Base):
     __tablename__ = "buy_orders"
@@ -149,6 +224,8 @@ class BuyOrder(Base):
     security = relationship("Security", back_populates="buy_orders", lazy="joined")
     round = relationship("Round", back_populates="buy_orders")
 
+    __table_args__ = (Index("ix_buy_orders_user_id_round_id", "user_id", "round_id"),)
+
 
 class Match(Base):
     __tablename__ = "matches"
@@ -165,6 +242,11 @@ class Match(Base):
     buy_order = relationship("BuyOrder", back_populates="matches")
     sell_order = relationship("SellOrder", back_populates="matches")
 
+    __table_args__ = (
+        Index("ix_matches_buy_order_id", "buy_order_id"),
+        Index("ix_matches_sell_order_id", "sell_order_id"),
+    )
+
 
 class Round(Base):
     __tablename__ = "rounds"
@@ -175,6 +257,18 @@ class Round(Base):
     buy_orders = relationship("BuyOrder", back_populates="round")
     sell_orders = relationship("SellOrder", back_populates="round")
 
+    __table_args__ = (
+        Index("ix_rounds_is_concluded_end_time", "is_concluded", "end_time"),
+    )
+
+
+class MatchRun(Base):
+    __tablename__ = "match_runs"
+
+    round_id = Column(UUID, ForeignKey("rounds.id", ondelete="CASCADE"), nullable=False)
+    # Records of the phases of MatchService.run_matches, see src.match.record_phase
+    stats = Column(JSONB, nullable=False)
+
 
 class BannedPair(Base):
     __tablename__ = "banned_pairs"
@@ -203,6 +297,8 @@ class ChatRoom(Base):
     disband_by_user_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"))
     disband_time = Column(DateTime)
 
+    __table_args__ = (Index("ix_chat_rooms_match_id", "match_id"),)
+
 
 class UserChatRoomAssociation(Base):
     __tablename__ = "user_chat_room_association"
@@ -214,8 +310,14 @@ class UserChatRoomAssociation(Base):
     is_revealed = Column(Boolean, nullable=False, server_default="f")
     is_archived = Column(Boolean, nullable=False, server_default="f")
     last_read_id = Column(UUID, ForeignKey("chats.id", ondelete="CASCADE"))
+    # chats of the other members after last_read_id, kept up to date on every write
+    unread_count = Column(Integer, nullable=False, server_default="0")
 
-    __table_args__ = (UniqueConstraint("user_id", "chat_room_id"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "chat_room_id"),
+        Index("ix_user_chat_room_association_chat_room_id", "chat_room_id"),
+        Index("ix_user_chat_room_association_user_id_role", "user_id", "role"),
+    )
 
 
 class Chat(Base):
@@ -227,6 +329,34 @@ class Chat(Base):
     message = Column(Text, nullable=False)
     author_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
 
+    __table_args__ = (
+        Index("ix_chats_chat_room_id_created_at", "chat_room_id", "created_at"),
+    )
+
+
+def unread_chats_count(session, last_read_id=UserChatRoomAssociation.last_read_id):
+    """
+    Returns the number of chats that the user of a UserChatRoomAssociation has not
+    read, as a subquery correlated to that association, e.g. to recount unread_count.
+
+    last_read_id: counts the chats after this chat instead.
+    """
+    last_read_chat = aliased(Chat)
+    last_read_at = (
+        session.query(last_read_chat.created_at)
+        .filter(last_read_chat.id == last_read_id)
+        .correlate(UserChatRoomAssociation)
+        .as_scalar()
+    )
+    return (
+        session.query(func.count(Chat.id))
+        .filter(Chat.chat_room_id == UserChatRoomAssociation.chat_room_id)
+        .filter(Chat.author_id != UserChatRoomAssociation.user_id)
+        .filter(or_(last_read_id.is_(None), Chat.created_at > last_read_at))
+        .correlate(UserChatRoomAssociation)
+        .as_scalar()
+    )
+
 
 class Offer(Base):
     __tablename__ = "offers"
@@ -243,6 +373,10 @@ class Offer(Base):
         server_default="PENDING",
     )
 
+    __table_args__ = (
+        Index("ix_offers_chat_room_id_offer_status", "chat_room_id", "offer_status"),
+    )
+
 
 class OfferResponse(Base):
     __tablename__ = "offer_responses"
@@ -250,6 +384,8 @@ class OfferResponse(Base):
     offer_id = Column(UUID, ForeignKey("offers.id", ondelete="CASCADE"), nullable=False)
     # TODO migrate Offer.offer_status to an "is_accepted" column here
 
+    __table_args__ = (Index("ix_offer_responses_offer_id", "offer_id"),)
+
 
 class UserRequest(Base):
     __tablename__ = "user_requests"
@@ -258,22 +394,278 @@ class UserRequest(Base):
     is_buy = Column(Boolean, nullable=False)
     closed_by_user_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"))
 
+    __table_args__ = (
+        Index(
+            "ix_user_requests_user_id_closed_by_user_id", "user_id", "closed_by_user_id"
+        ),
+    )
+
+
+class PoolMetrics:
+    """
+    Live counters of the connection pool: how long checkouts waited for a
+    connection, how many gave up, and which lines of code check out connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait_time = 0.0
+            self.max_wait_time = 0.0
+            self.peak_checked_out = 0
+            self.hotspots = Counter()
+
+    def record_checkout(self, wait_time, call_site, checked_out):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            self.hotspots[call_site] += 1
+
+    def record_timeout(self, wait_time, call_site):
+        with self._lock:
+            self.timeouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.hotspots[call_site] += 1
+
+    def snapshot(self, pool):
+        with self._lock:
+            return {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "peak_checked_out": self.peak_checked_out,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_time": self.total_wait_time,
+                "max_wait_time": self.max_wait_time,
+                "hotspots": self.hotspots.most_common(10),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+def _call_site():
+    """
+    Returns the innermost line of the app, outside of this file, that is running.
+    """
+    src = os.path.dirname(os.path.abspath(__file__))
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(src) and filename != __file__:
+            name = os.path.basename(filename)
+            return f"{name}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return "unknown"
+
+
+# seconds to wait for a connection in the current context, instead of the timeout of
+# the pool, see run_in_database_executor
+pool_timeout = ContextVar("pool_timeout", default=None)
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    A QueuePool that records every checkout in pool_metrics, and that waits for a
+    connection for pool_timeout seconds when it is set.
+    """
+
+    @property
+    def _timeout(self):
+        timeout = pool_timeout.get()
+        return self._default_timeout if timeout is None else timeout
+
+    @_timeout.setter
+    def _timeout(self, timeout):
+        self._default_timeout = timeout
+
+    def recreate(self):
+        token = pool_timeout.set(None)
+        try:
+            return super().recreate()
+        finally:
+            pool_timeout.reset(token)
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_timeout(time.monotonic() - start, _call_site())
+            raise
+        pool_metrics.record_checkout(
+            time.monotonic() - start, _call_site(), self.checkedout()
+        )
+        return connection
+
+
+engine = create_engine(
+    APP_CONFIG["DATABASE_URL"],
+    poolclass=MeteredQueuePool,
+    pool_size=APP_CONFIG["DATABASE_POOL_SIZE"],
+    max_overflow=APP_CONFIG["DATABASE_MAX_OVERFLOW"],
+    pool_timeout=APP_CONFIG["DATABASE_JOB_POOL_TIMEOUT"],
+    pool_pre_ping=APP_CONFIG["DATABASE_POOL_PRE_PING"],
+    pool_recycle=APP_CONFIG["DATABASE_POOL_RECYCLE"],
+)
+
 
-engine = create_engine(APP_CONFIG["DATABASE_URL"])
+def database_pool_stats():
+    return pool_metrics.snapshot(engine.pool)
 
 
 Session = sessionmaker(bind=engine)
 
 
+# session of the outermost session_scope that is running
+_current_session = ContextVar("current_session", default=None)
+
+
 @contextmanager
 def session_scope():
-    """Provide a transactional scope around a series of operations."""
+    """
+    Provide a transactional scope around a series of operations.
+
+    A scope opened inside another one, e.g. when a service calls another service,
+    shares the session, and so the connection and the transaction, of the outermost
+    scope. Only the outermost scope commits or rolls back.
+    """
+    session = _current_session.get()
+    if session is not None:
+        yield session
+        return
+
     session = Session()
+    token = _current_session.set(session)
     try:
         yield session
         session.commit()
+    except exc.TimeoutError as e:
+        session.rollback()
+        raise DatabaseUnavailableException("Database is busy, try again later.") from e
     except:
         session.rollback()
         raise
     finally:
+        _current_session.reset(token)
         session.close()
+
+    for callback in session.info.pop("after_commit", []):
+        callback()
+
+
+def run_after_commit(function, *args, **kwargs):
+    """
+    Calls function once the outermost session_scope commits, or right away outside
+    of any session_scope.
+    """
+    session = _current_session.get()
+    if session is None:
+        function(*args, **kwargs)
+    else:
+        session.info.setdefault("after_commit", []).append(
+            partial(function, *args, **kwargs)
+        )
+
+
+def run_in_unit_of_work(function, *args, **kwargs):
+    """
+    Calls function with every session_scope inside it sharing one transaction.
+    """
+    with session_scope():
+        return function(*args, **kwargs)
+
+
+def notify(session, channel):
+    """
+    Sends a Postgres NOTIFY on channel, once the transaction of session commits.
+    """
+    session.execute(f"NOTIFY {channel}")
+
+
+def listen(channel, callback, reconnect_delay=5):
+    """
+    Calls callback on a daemon thread whenever a NOTIFY on channel is committed, by
+    this process or any other. Also calls it whenever it (re)connects, since
+    notifications may have been missed while it was not listening.
+    """
+
+    def run():
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(APP_CONFIG["DATABASE_URL"])
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {channel}")
+                callback()
+
+                while True:
+                    readable, _, _ = select.select([connection], [], [], 60)
+                    if readable:
+                        connection.poll()
+                        if connection.notifies:
+                            del connection.notifies[:]
+                            callback()
+            except psycopg2.Error as e:
+                print(f"Listening on {channel} failed: {e}")
+            finally:
+                if connection is not None:
+                    connection.close()
+            time.sleep(reconnect_delay)
+
+    thread = threading.Thread(target=run, name=f"listen-{channel}", daemon=True)
+    thread.start()
+    return thread
+
+
+# Runs the blocking database work of the async handlers. With as many threads as the
+# pool has connections, a thread only waits for a connection when a service checks
+# out more than one at a time.
+database_executor = ThreadPoolExecutor(APP_CONFIG["DATABASE_THREADS"])
+
+
+async def run_in_database_executor(function, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    context = copy_context()
+    # requests fail fast with a 503 rather than queue up behind a busy pool, while
+    # background jobs wait for DATABASE_JOB_POOL_TIMEOUT seconds
+    context.run(pool_timeout.set, APP_CONFIG["DATABASE_POOL_TIMEOUT"])
+    return await loop.run_in_executor(
+        database_executor,
+        partial(context.run, run_in_unit_of_work, function, *args, **kwargs),
+    )
+
+
+class AsyncService:
+    """
+    Wraps a service from services.py, so that its methods are coroutines that run the
+    original method on database_executor. The event loop keeps serving other requests
+    while a method waits on the database. Every call is a single unit of work, with one
+    connection and one transaction.
+
+    e.g. await AsyncService(RoundService(config)).get_active()
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, name):
+        attribute = getattr(self.service, name)
+        if not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        async def method(*args, **kwargs):
+            return await run_in_database_executor(attribute, *args, **kwargs)
+
+        return method
@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.exceptions import UserProfileNotFoundException
+
+
+class LinkedInClient:
+    """
+    Talks to the LinkedIn OAuth and profile APIs over a pool of kept-alive
+    connections, giving up after LINKEDIN_TIMEOUT seconds.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.timeout = config["LINKEDIN_TIMEOUT"]
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=config["LINKEDIN_POOL_SIZE"])
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # fetches the email address and the profile while the caller waits or makes
+        # other requests
+        self.executor = ThreadPoolExecutor(config["LINKEDIN_POOL_SIZE"])
+
+    def get_access_token(self, code, redirect_uri, client_id, client_secret):
+        res = self._request(
+            "post",
+            f"{self.config['LINKEDIN_OAUTH_URL']}/accessToken",
+            headers={"Content-Type": "x-www-form-urlencoded"},
+            params={
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": redirect_uri,
+                "client_id": client_id,
+                "client_secret": client_secret,
+            },
+        )
+        json_res = res.json()
+        if json_res.get("access_token") is None:
+            print(res, json_res)
+            raise UserProfileNotFoundException("Token retrieval failed.")
+        return json_res
+
+    def get_member_id(self, token):
+        res = self._get(token, "/me?projection=(id)")
+        if res.status_code == 401:
+            raise UserProfileNotFoundException("User profile not found.")
+        if not res.ok or res.json().get("id") is None:
+            raise UserProfileNotFoundException(
+                "Member id retrieval failed.", status_code=503
+            )
+        return res.json()["id"]
+
+    def get_profile(self, token):
+        """
+        Returns the email, full name, display image and LinkedIn id of the owner of
+        `token`, fetching the email address and the profile concurrently.
+        """
+        return self.start_get_profile(token)()
+
+    def start_get_profile(self, token):
+        """
+        Starts fetching what get_profile returns on the executor, and returns a
+        function that waits for it. The caller can make other requests meanwhile.
+        """
+        email_future = self.executor.submit(
+            self._get, token, "/emailAddress?q=members&projection=(elements*(handle~))"
+        )
+        user_profile_future = self.executor.submit(
+            self._get,
+            token,
+            "/me?projection=(id,firstName,lastName,profilePicture(displayImage~:playableStreams))",
+        )
+        return lambda: self._parse_profile(
+            email_future.result(), user_profile_future.result()
+        )
+
+    @staticmethod
+    def _parse_profile(email_request, user_profile_request):
+        if email_request.status_code == 401:
+            raise UserProfileNotFoundException("User email not found.")
+        email_data = email_request.json()
+        email = email_data.get("elements")[0].get("handle~").get("emailAddress")
+
+        if user_profile_request.status_code == 401:
+            raise UserProfileNotFoundException("User profile not found.")
+        user_profile_data = user_profile_request.json()
+        first_name = user_profile_data.get("firstName").get("localized").get("en_US")
+        last_name = user_profile_data.get("lastName").get("localized").get("en_US")
+        try:
+            display_image_url = (
+                user_profile_data.get("profilePicture")
+                .get("displayImage~")
+                .get("elements")[-1]
+                .get("identifiers")[0]
+                .get("identifier")
+            )
+        except AttributeError:
+            display_image_url = None
+
+        return {
+            "email": email,
+            "full_name": f"{first_name} {last_name}",
+            "display_image_url": display_image_url,
+            "provider_user_id": user_profile_data.get("id"),
+        }
+
+    def _get(self, token, path):
+        return self._request(
+            "get",
+            f"{self.config['LINKEDIN_API_URL']}{path}",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    def _request(self, method, url, **kwargs):
+        try:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            print(f"LinkedIn request failed: method={method} url={url} error={e!r}")
+            raise UserProfileNotFoundException(
+                "LinkedIn is unreachable.", status_code=503
+            ) from e
@@ -1,14 +1,33 @@
-from copy import deepcopy
+import heapq
+import multiprocessing
+import resource
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
 
 import networkx as nx
+import numpy as np
 from networkx.algorithms.matching import max_weight_matching
+from scipy.optimize import linear_sum_assignment
+from sortedcontainers import SortedDict, SortedList
 
 
-def match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches):
+def match_buyers_and_sellers(
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    solver="networkx",
+    max_edges_per_order=None,
+    time_budget=None,
+    stats=None,
+):
     """
     The matching algorithm.
 
     Currently, this operates on the assumption that all securities passed in are the same.
+    See match_buyers_and_sellers_by_security for books with several securities.
 
     Params:
     buy_orders: e.g. [{'id': 'UUID', 'user_id': 'UUID', 'security_id': 'UUID',
@@ -17,6 +36,13 @@ def match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches):
                         'number_of_shares': 20.0, 'price': 30.0}]
     banned_user_matches: users that cannot be matched together. Pass in enumerable of pairs.
     e.g. set(('buyer_uuid', 'seller_uuid'), ('buyer2_uuid', 'seller2_uuid'))
+    solver: name of the backend in SOLVERS used for the first matching.
+    max_edges_per_order: if set, the first matching only considers the given number of
+    cheapest pairs of every order. Faster on large books, but may miss the optimum.
+    time_budget: seconds that the 'anytime' solver may spend on the first matching.
+    stats: if set, a dict that gets a record for every phase of the algorithm, with
+    the matching_quality of the first matching under 'first_matching'. See
+    record_phase.
 
     Returns:
     Set of pairs of order IDs as matches.
@@ -25,105 +51,827 @@ def match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches):
     """
 
     max_number_of_shares = max(o["number_of_shares"] for o in buy_orders + sell_orders)
-    buy_orders_copy = deepcopy(buy_orders)
-    sell_orders_copy = deepcopy(sell_orders)
+    buys = _Orders.from_dicts(buy_orders)
+    sells = _Orders.from_dicts(sell_orders)
+    banned_pairs = _intern_banned_pairs(banned_user_matches, buys, sells)
 
-    first_iteration = match_seller_with_nearest_buyer(
-        buy_orders_copy, sell_orders_copy, banned_user_matches, max_number_of_shares
+    first_iteration = _match_seller_with_nearest_buyer(
+        buys,
+        sells,
+        banned_pairs,
+        max_number_of_shares,
+        solver=solver,
+        max_edges_per_order=max_edges_per_order,
+        time_budget=time_budget,
+        stats=stats,
     )
 
-    matched_buy_order_ids = {
-        buy_order_id for buy_order_id in [p[0] for p in first_iteration]
-    }
-    remaining_buy_orders = []
-    for buy_order in buy_orders_copy:
-        if buy_order["id"] not in matched_buy_order_ids:
-            remaining_buy_orders.append(buy_order)
+    is_matched = np.isin(buys.ids, [buy_id for buy_id, _ in first_iteration])
+    remaining_buys = buys.take(np.flatnonzero(~is_matched))
+
+    with record_phase(stats, "distribution") as record:
+        subsequent, _ = _distribute_remaining_buyers(
+            remaining_buys, sells, banned_pairs, record=record
+        )
+        record["matches"] = len(subsequent)
+
+    return buys.translate(sells, first_iteration | subsequent)
+
+
+def match_buyers_and_sellers_by_security(
+    buy_orders, sell_orders, banned_user_matches, max_workers=1, stats=None, **kwargs
+):
+    """
+    Runs match_buyers_and_sellers separately on the orders of every security, since
+    orders for different securities can never be matched together.
+
+    Params:
+    Same as match_buyers_and_sellers, with every order having a 'security_id'.
+    max_workers: number of processes solving securities in parallel. With 1, or with a
+    single security, everything runs in the current process.
+    stats: if set, a dict that gets the stats of match_buyers_and_sellers of every
+    matched security under its security_id.
+    kwargs: passed on to match_buyers_and_sellers.
+
+    Returns:
+    Set of pairs of order IDs as matches, like match_buyers_and_sellers.
+    """
+    partitions = defaultdict(lambda: ([], []))
+    for buy_order in buy_orders:
+        partitions[buy_order["security_id"]][0].append(buy_order)
+    for sell_order in sell_orders:
+        partitions[sell_order["security_id"]][1].append(sell_order)
+
+    banned_user_matches = set(banned_user_matches)
+    jobs = []
+    for security_id, (security_buy_orders, security_sell_orders) in partitions.items():
+        if len(security_buy_orders) == 0 or len(security_sell_orders) == 0:
+            continue
+
+        # Only send the banned pairs of the users in this partition to the worker
+        buyer_ids = {o["user_id"] for o in security_buy_orders}
+        seller_ids = {o["user_id"] for o in security_sell_orders}
+        security_banned_user_matches = {
+            (buyer_id, seller_id)
+            for buyer_id, seller_id in banned_user_matches
+            if buyer_id in buyer_ids and seller_id in seller_ids
+        }
+        jobs.append(
+            (
+                security_id,
+                (
+                    security_buy_orders,
+                    security_sell_orders,
+                    security_banned_user_matches,
+                ),
+            )
+        )
+
+    if max_workers <= 1 or len(jobs) <= 1:
+        results = [_match_security(*job, kwargs) for _, job in jobs]
+    else:
+        # spawned rather than forked, since forking copies the locks and connections
+        # held by the threads of the app
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(_match_security, *job, kwargs) for _, job in jobs
+            ]
+            results = [future.result() for future in futures]
 
-    subsequent = distribute_remaining_buyers(
-        remaining_buy_orders, sell_orders_copy, banned_user_matches
+    if stats is not None:
+        for (security_id, _), (_, security_stats) in zip(jobs, results):
+            stats[security_id] = security_stats
+
+    return set().union(*(matches for matches, _ in results))
+
+
+def _match_security(buy_orders, sell_orders, banned_user_matches, kwargs):
+    """
+    Runs match_buyers_and_sellers, possibly in a worker process, and returns the
+    matches with their stats, since the stats dict of a worker is not shared.
+    """
+    stats = {}
+    matches = match_buyers_and_sellers(
+        buy_orders, sell_orders, banned_user_matches, stats=stats, **kwargs
     )
+    return matches, stats
+
 
-    return first_iteration | subsequent
+@contextmanager
+def record_phase(stats, phase):
+    """
+    Yields a record, stats[phase], that the phase can add counters to. After the phase,
+    the record gets its 'wall_time' in seconds and 'max_rss', the peak resident memory
+    of the process so far in kilobytes, even if the phase raises. Without stats, the
+    record is thrown away.
+    """
+    record = {} if stats is None else stats.setdefault(phase, {})
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_time"] = time.perf_counter() - start
+        record["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def double_sell_orders(sell_orders):
+    """
+    Returns the sell orders with the order of every seller with a single sell order
+    appearing twice, so that it may be matched with two buyers.
+    """
+    seller_counts = defaultdict(lambda: 0)
+    for sell_order in sell_orders:
+        seller_counts[sell_order["user_id"]] += 1
+
+    new_sell_orders = []
+    for sell_order in sell_orders:
+        new_sell_orders.append(sell_order)
+        if seller_counts[sell_order["user_id"]] == 1:
+            new_sell_orders.append(sell_order)
+
+    return new_sell_orders
 
 
 def match_seller_with_nearest_buyer(
-    buy_orders, sell_orders, banned_user_matches, max_number_of_shares
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    max_number_of_shares,
+    solver="networkx",
+    max_edges_per_order=None,
+    time_budget=None,
 ):
-    def get_cost(buy_order, sell_order):
-        if buy_order["price"] < sell_order["price"] or (
-            (buy_order["user_id"], sell_order["user_id"]) in banned_user_matches
-        ):
-            return None
-        return abs(
-            buy_order["price"] - sell_order["price"]
-        ) * max_number_of_shares * 2 + abs(
-            buy_order["number_of_shares"] - sell_order["number_of_shares"]
+    buys = _Orders.from_dicts(buy_orders)
+    sells = _Orders.from_dicts(sell_orders)
+    matching = _match_seller_with_nearest_buyer(
+        buys,
+        sells,
+        _intern_banned_pairs(banned_user_matches, buys, sells),
+        max_number_of_shares,
+        solver=solver,
+        max_edges_per_order=max_edges_per_order,
+        time_budget=time_budget,
+    )
+    return buys.translate(sells, matching)
+
+
+def _match_seller_with_nearest_buyer(
+    buys,
+    sells,
+    banned_pairs,
+    max_number_of_shares,
+    solver="networkx",
+    max_edges_per_order=None,
+    time_budget=None,
+    stats=None,
+):
+    """
+    Same as match_seller_with_nearest_buyer on interned orders. With stats, adds records
+    of the 'generate_edges' and 'solve' phases to it, and the matching_quality of the
+    matching under 'first_matching'.
+
+    Returns:
+    Set of (buy order ID, sell order ID) pairs of interned IDs.
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown matching solver: {solver}")
+
+    with record_phase(stats, "generate_edges") as record:
+        rows, cols, costs = _generate_edges(
+            buys,
+            sells,
+            banned_pairs,
+            max_number_of_shares,
+            max_edges_per_order=max_edges_per_order,
+        )
+        record["buy_orders"] = len(buys)
+        record["sell_orders"] = len(sells)
+        record["nodes"] = len(np.unique(rows)) + len(np.unique(cols))
+        record["edges"] = len(costs)
+
+    with record_phase(stats, "solve") as record:
+        matching = SOLVERS[solver](rows, cols, costs, time_budget=time_budget)
+        record["solver"] = solver
+
+    if stats is not None:
+        stats["first_matching"] = matching_quality(rows, cols, costs, matching)
+
+    return matching
+
+
+class _Orders:
+    """
+    One side of an order book as parallel arrays, with order and user IDs interned as
+    dense integers, so that the matching compares ints instead of UUID strings.
+
+    The k-th order has ID order_ids[ids[k]] and user ID user_ids[users[k]].
+    """
+
+    __slots__ = ("order_ids", "user_ids", "ids", "users", "prices", "shares")
+
+    def __init__(self, order_ids, user_ids, ids, users, prices, shares):
+        self.order_ids = order_ids
+        self.user_ids = user_ids
+        self.ids = ids
+        self.users = users
+        self.prices = prices
+        self.shares = shares
+
+    @classmethod
+    def from_dicts(cls, orders):
+        order_index = {}
+        user_index = {}
+        ids = np.array(
+            [order_index.setdefault(o["id"], len(order_index)) for o in orders],
+            dtype=np.int64,
+        )
+        users = np.array(
+            [user_index.setdefault(o["user_id"], len(user_index)) for o in orders],
+            dtype=np.int64,
+        )
+        return cls(
+            list(order_index),
+            list(user_index),
+            ids,
+            users,
+            np.array([o["price"] for o in orders], dtype=float),
+            np.array([o["number_of_shares"] for o in orders], dtype=float),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, positions):
+        """
+        Returns the orders at positions, sharing the interned IDs of these orders.
+        """
+        return _Orders(
+            self.order_ids,
+            self.user_ids,
+            self.ids[positions],
+            self.users[positions],
+            self.prices[positions],
+            self.shares[positions],
+        )
+
+    def translate(self, sells, matches):
+        """
+        Translates pairs of interned (buy order ID, sell order ID), with self as the buy
+        orders, back to pairs of order IDs.
+        """
+        return {(self.order_ids[i], sells.order_ids[j]) for i, j in matches}
+
+
+def _intern_banned_pairs(banned_user_matches, buys, sells):
+    """
+    Returns the banned pairs between the users of buys and sells as a set of ints,
+    buyer * len(sells.user_ids) + seller, with buyer and seller interned user IDs.
+    """
+    buyer_index = {user_id: i for i, user_id in enumerate(buys.user_ids)}
+    seller_index = {user_id: j for j, user_id in enumerate(sells.user_ids)}
+    return {
+        buyer_index[buyer_id] * len(seller_index) + seller_index[seller_id]
+        for buyer_id, seller_id in banned_user_matches
+        if buyer_id in buyer_index and seller_id in seller_index
+    }
+
+
+# Upper bound on the number of candidate pairs generated at once
+EDGE_CHUNK_SIZE = 2 ** 20
+
+
+def generate_edges(
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    max_number_of_shares,
+    max_edges_per_order=None,
+):
+    """
+    Lists the pairs of buy and sell orders that can be matched, with their costs.
+
+    Sell orders are sorted by price, so the sell orders that a buy order can be matched
+    with are a prefix of them, found by bisection. Only those pairs are generated, in
+    chunks of buy orders, so memory grows with the number of feasible pairs instead of
+    with the product of the book sizes. With max_edges_per_order, only the pairs that
+    are among the cheapest max_edges_per_order pairs of their buy order or of their
+    sell order are kept, after every chunk.
+
+    Orders sharing an ID are the same node: for every pair of IDs, the last pair of
+    orders that can be matched gives the cost.
+
+    Returns:
+    (buy_order_ids, sell_order_ids, rows, cols, costs): the k-th pair matches
+    buy_order_ids[rows[k]] with sell_order_ids[cols[k]] at costs[k].
+    """
+    buys = _Orders.from_dicts(buy_orders)
+    sells = _Orders.from_dicts(sell_orders)
+    rows, cols, costs = _generate_edges(
+        buys,
+        sells,
+        _intern_banned_pairs(banned_user_matches, buys, sells),
+        max_number_of_shares,
+        max_edges_per_order=max_edges_per_order,
+    )
+    return buys.order_ids, sells.order_ids, rows, cols, costs
+
+
+def _generate_edges(
+    buys, sells, banned_pairs, max_number_of_shares, max_edges_per_order=None
+):
+    """
+    Same as generate_edges on interned orders, where rows and cols are interned order
+    IDs.
+    """
+    # Repeated orders, such as doubled sell orders, have the same edges
+    buys = buys.take(_last_distinct_copies(buys))
+    sells = sells.take(_last_distinct_copies(sells))
+
+    number_of_sellers = len(sells.user_ids)
+    banned_pair_codes = np.array(sorted(banned_pairs), dtype=np.int64)
+
+    sell_orders_by_price = np.argsort(sells.prices, kind="stable")
+    # Number of sell orders priced at or below each buy order
+    feasible_counts = np.searchsorted(
+        sells.prices[sell_orders_by_price], buys.prices, side="right"
+    )
+    feasible_ends = np.cumsum(feasible_counts)
+
+    has_shared_ids = (len(buys.order_ids), len(sells.order_ids)) != (
+        len(buys),
+        len(sells),
+    )
+
+    chunks = []
+    start = 0
+    while start < len(buys):
+        chunk_base = feasible_ends[start - 1] if start > 0 else 0
+        stop = max(
+            np.searchsorted(feasible_ends, chunk_base + EDGE_CHUNK_SIZE, side="right"),
+            start + 1,
+        )
+        counts = feasible_counts[start:stop]
+
+        rows = np.repeat(np.arange(start, stop), counts)
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        cols = sell_orders_by_price[np.arange(len(rows)) - offsets]
+
+        if len(banned_pair_codes) > 0:
+            allowed = ~np.isin(
+                buys.users[rows] * number_of_sellers + sells.users[cols],
+                banned_pair_codes,
+            )
+            rows = rows[allowed]
+            cols = cols[allowed]
+
+        costs = buys.prices[rows] - sells.prices[cols]
+        costs *= max_number_of_shares * 2
+        costs += np.abs(buys.shares[rows] - sells.shares[cols])
+
+        # Later orders replace earlier ones, going through sell orders, then buy orders
+        copy_order = cols * len(buys) + rows
+        chunks.append((buys.ids[rows], sells.ids[cols], costs, copy_order))
+
+        if max_edges_per_order is not None:
+            edges = _merge_edges(chunks, len(sells.order_ids), has_shared_ids)
+            chunks = [_keep_cheapest_edges(edges, max_edges_per_order)]
+
+        start = stop
+
+    rows, cols, costs, _ = _merge_edges(chunks, len(sells.order_ids), has_shared_ids)
+    return rows, cols, costs
+
+
+def _last_distinct_copies(orders):
+    """
+    Returns the positions of the orders that are not repeated later on.
+    """
+    last_positions = {}
+    for position, key in enumerate(
+        zip(
+            orders.ids.tolist(),
+            orders.users.tolist(),
+            orders.prices.tolist(),
+            orders.shares.tolist(),
+        )
+    ):
+        last_positions[key] = position
+    return np.array(sorted(last_positions.values()), dtype=np.int64)
+
+
+def _merge_edges(chunks, number_of_cols, has_shared_ids):
+    """
+    Concatenates chunks of (rows, cols, costs, copy_order) edges. If orders share IDs,
+    only the edge with the greatest copy_order between any two nodes is kept.
+    """
+    if len(chunks) == 0:
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=float),
+            np.empty(0, dtype=np.int64),
+        )
+
+    rows, cols, costs, copy_order = (np.concatenate(arrays) for arrays in zip(*chunks))
+    if not has_shared_ids:
+        return rows, cols, costs, copy_order
+
+    nodes = rows * number_of_cols + cols
+    by_node_then_copy = np.lexsort((copy_order, nodes))
+    sorted_nodes = nodes[by_node_then_copy]
+    is_last = np.append(sorted_nodes[1:] != sorted_nodes[:-1], True)
+    keep = by_node_then_copy[is_last]
+    return rows[keep], cols[keep], costs[keep], copy_order[keep]
+
+
+def _keep_cheapest_edges(edges, max_edges_per_order):
+    """
+    Keeps the edges that are among the max_edges_per_order cheapest edges of their row
+    or of their column.
+    """
+    rows, cols, costs, copy_order = edges
+    cost_ranks = np.empty(len(costs), dtype=np.int64)
+    cost_ranks[np.argsort(costs)] = np.arange(len(costs))
+
+    keep = np.zeros(len(costs), dtype=bool)
+    for nodes in (rows, cols):
+        # Sorting on a single integer key is much faster than a lexsort
+        by_node_then_cost = np.argsort(nodes * len(costs) + cost_ranks)
+        sorted_nodes = nodes[by_node_then_cost]
+        is_first = np.insert(sorted_nodes[1:] != sorted_nodes[:-1], 0, True)
+        group_starts = np.flatnonzero(is_first)
+        ranks = np.arange(len(costs)) - np.repeat(
+            group_starts, np.diff(np.append(group_starts, len(costs)))
         )
+        keep[by_node_then_cost[ranks < max_edges_per_order]] = True
+
+    return rows[keep], cols[keep], costs[keep], copy_order[keep]
+
+
+def solve_with_networkx(rows, cols, costs, time_budget=None):
+    """
+    Minimum cost matching among the matchings of maximum cardinality, using the general
+    graph matching of networkx.
+
+    The k-th edge connects buy order rows[k] and sell order cols[k] at costs[k]. Exact
+    solvers ignore time_budget.
+
+    Returns:
+    Set of (buy order index, sell order index) pairs.
+    """
+    # Add the edges sell order by sell order, then buy order by buy order, since ties
+    # between matchings are broken by the order of the graph
+    by_sell_order = np.lexsort((rows, cols))
 
     graph = nx.Graph()
-    for sell_order in sell_orders:
-        for buy_order in buy_orders:
-            cost = get_cost(buy_order, sell_order)
-            if cost is not None:
-                # Invert the cost, since the algorithm computes the maximum total instead of the
-                # minimum
-                graph.add_edge(buy_order["id"], sell_order["id"], weight=-cost)
+    # Invert the cost, since the algorithm computes the maximum total instead of the
+    # minimum
+    graph.add_weighted_edges_from(
+        (("buy", i), ("sell", j), -cost)
+        for i, j, cost in zip(
+            rows[by_sell_order].tolist(),
+            cols[by_sell_order].tolist(),
+            costs[by_sell_order].tolist(),
+        )
+    )
 
     matching = max_weight_matching(graph, maxcardinality=True)
 
-    buy_order_ids = {buy_order["id"] for buy_order in buy_orders}
-
     result = set()
     for pair in matching:
-        buy_order_id = pair[0] if pair[0] in buy_order_ids else pair[1]
-        sell_order_id = pair[1] if pair[0] in buy_order_ids else pair[0]
-        result.add((buy_order_id, sell_order_id))
+        buy_node, sell_node = pair if pair[0][0] == "buy" else pair[::-1]
+        result.add((buy_node[1], sell_node[1]))
 
     return result
 
 
+def solve_with_dense_assignment(rows, cols, costs, time_budget=None):
+    """
+    Same objective as solve_with_networkx, solved as a rectangular assignment problem on
+    a dense cost matrix (shortest augmenting path, Jonker-Volgenant style).
+    """
+    if len(costs) == 0:
+        return set()
+
+    # Only orders with at least one edge take part in the assignment
+    buy_nodes, row_indices = np.unique(rows, return_inverse=True)
+    sell_nodes, col_indices = np.unique(cols, return_inverse=True)
+
+    # Infeasible pairs are masked with a penalty larger than the cost of any matching,
+    # so the solver first maximizes the number of feasible pairs, like maxcardinality
+    cost_matrix = np.full((len(buy_nodes), len(sell_nodes)), costs.sum() + 1)
+    cost_matrix[row_indices, col_indices] = costs
+    feasible = np.zeros(cost_matrix.shape, dtype=bool)
+    feasible[row_indices, col_indices] = True
+
+    matched_rows, matched_cols = linear_sum_assignment(cost_matrix)
+
+    return {
+        (buy_nodes[i].item(), sell_nodes[j].item())
+        for i, j in zip(matched_rows, matched_cols)
+        if feasible[i, j]
+    }
+
+
+def solve_anytime(rows, cols, costs, time_budget=None):
+    """
+    Approximates the objective of solve_with_networkx within time_budget seconds.
+
+    Starts from a greedy matching that takes the cheapest pairs first, so the nearest
+    prices first. Until the deadline, augmenting paths then add pairs until the number
+    of pairs is maximum, and local swap passes lower the cost while they can. Without
+    time_budget both run to the end, which gives a maximum number of pairs, but not
+    always the minimum cost. See matching_quality for how far it is from the optimum.
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+
+    def expired():
+        return deadline is not None and time.monotonic() >= deadline
+
+    by_cost = np.argsort(costs, kind="stable")
+    edges = list(zip(rows[by_cost].tolist(), cols[by_cost].tolist()))
+    edge_costs = dict(zip(edges, costs[by_cost].tolist()))
+    # Buy order -> sell orders it can be matched with, cheapest first
+    neighbors = defaultdict(list)
+    for i, j in edges:
+        neighbors[i].append(j)
+
+    row_matches = {}
+    col_matches = {}
+    for i, j in edges:
+        if i not in row_matches and j not in col_matches:
+            row_matches[i] = j
+            col_matches[j] = i
+
+    # A buy order without an augmenting path never gets one after other augmentations,
+    # so every buy order is tried once
+    for i in list(neighbors):
+        if expired():
+            break
+        if i not in row_matches:
+            _augment(i, neighbors, row_matches, col_matches)
+
+    improved = True
+    while improved and not expired():
+        improved = False
+        for i in list(neighbors):
+            if expired():
+                break
+            improved |= _improve_by_swapping(
+                i, neighbors, edge_costs, row_matches, col_matches
+            )
+
+    return set(row_matches.items())
+
+
+def _augment(root, neighbors, row_matches, col_matches):
+    """
+    Searches breadth-first for an augmenting path from the unmatched buy order root, and
+    flips the path if there is one. Returns whether the matching grew.
+    """
+    parents = {}
+    queue = [root]
+    for i in queue:
+        for j in neighbors[i]:
+            if j in parents:
+                continue
+            parents[j] = i
+            if j not in col_matches:
+                while j is not None:
+                    i = parents[j]
+                    previous_j = row_matches.get(i)
+                    row_matches[i] = j
+                    col_matches[j] = i
+                    j = previous_j
+                return True
+            queue.append(col_matches[j])
+
+    return False
+
+
+def _improve_by_swapping(i, neighbors, edge_costs, row_matches, col_matches):
+    """
+    Moves buy order i to a cheaper sell order, if that keeps the number of pairs and
+    lowers the cost, or adds i to the matching if it is unmatched. The sell order may be
+    unmatched, or matched to a buy order that can take the current sell order of i, or
+    i may replace its buy order if i is unmatched. Returns whether the matching changed.
+    """
+    j = row_matches.get(i)
+    cost = edge_costs[(i, j)] if j is not None else None
+
+    for new_j in neighbors[i]:
+        new_cost = edge_costs[(i, new_j)]
+        if new_j == j or (cost is not None and new_cost >= cost):
+            break
+
+        other_i = col_matches.get(new_j)
+        if other_i is None:
+            if j is not None:
+                del col_matches[j]
+            row_matches[i] = new_j
+            col_matches[new_j] = i
+            return True
+        elif j is None:
+            # i is unmatched, so it can only replace a more expensive buy order
+            if new_cost < edge_costs[(other_i, new_j)]:
+                del row_matches[other_i]
+                row_matches[i] = new_j
+                col_matches[new_j] = i
+                return True
+        elif (other_i, j) in edge_costs and new_cost + edge_costs[
+            (other_i, j)
+        ] < cost + edge_costs[(other_i, new_j)]:
+            row_matches[i] = new_j
+            col_matches[new_j] = i
+            row_matches[other_i] = j
+            col_matches[j] = other_i
+            return True
+
+    return False
+
+
+SOLVERS = {
+    "networkx": solve_with_networkx,
+    "dense_assignment": solve_with_dense_assignment,
+    "anytime": solve_anytime,
+}
+
+
+def matching_quality(rows, cols, costs, matching):
+    """
+    Bounds how far a first matching is from the optimum, which has the most pairs, then
+    the least cost.
+
+    Returns:
+    {'matches': number of pairs, 'max_matches': upper bound on the number of pairs,
+     'cost': total cost, 'cost_lower_bound': lower bound on the cost of any matching
+     with as many pairs}
+    """
+    edge_costs = dict(zip(zip(rows.tolist(), cols.tolist()), costs.tolist()))
+    cost = sum(edge_costs[pair] for pair in matching)
+
+    # Every matched order pays at least the cost of its cheapest pair
+    cost_lower_bound = 0.0
+    for nodes in (rows, cols):
+        cheapest = defaultdict(lambda: float("inf"))
+        for node, node_cost in zip(nodes.tolist(), costs.tolist()):
+            cheapest[node] = min(cheapest[node], node_cost)
+        cost_lower_bound = max(
+            cost_lower_bound, sum(sorted(cheapest.values())[: len(matching)])
+        )
+
+    return {
+        "matches": len(matching),
+        "max_matches": min(len(set(rows.tolist())), len(set(cols.tolist()))),
+        "cost": cost,
+        "cost_lower_bound": cost_lower_bound,
+    }
+
+
 def distribute_remaining_buyers(buy_orders, sell_orders, banned_user_matches):
     """
     NOTE: Mutates buy_orders by removing those that are matched.
+
+    In every pass, each remaining sell order, from the most to the least desperate,
+    takes the most desperate buy order it can be matched with: greatest price, then
+    nearest number of shares, then earliest in buy_orders. A sell order leaves once no
+    buy order is left for it.
     """
+    buys = _Orders.from_dicts(buy_orders)
+    sells = _Orders.from_dicts(sell_orders)
+    matches, remaining_positions = _distribute_remaining_buyers(
+        buys, sells, _intern_banned_pairs(banned_user_matches, buys, sells)
+    )
 
-    def cmp(sell_order, buy_order):
-        return (
-            -buy_order["price"],  # most desperate: greatest price
-            abs(sell_order["number_of_shares"] - buy_order["number_of_shares"]),
-        )
+    buy_orders[:] = [buy_orders[i] for i in remaining_positions]
+
+    return buys.translate(sells, matches)
+
+
+def _distribute_remaining_buyers(buys, sells, banned_pairs, record=None):
+    """
+    Same as distribute_remaining_buyers on interned orders, without mutating them. With
+    record, adds the number of passes to it.
+
+    Returns:
+    (matches as pairs of interned order IDs, positions of the unmatched buy orders)
+    """
+    remaining_buy_orders = _BuyOrderBook(buys, banned_pairs, len(sells.user_ids))
+    sell_ids = sells.ids.tolist()
+    sell_users = sells.users.tolist()
+    sell_prices = sells.prices.tolist()
+    sell_shares = sells.shares.tolist()
+    buy_ids = buys.ids.tolist()
 
     result = set()
 
     # Sort by most --> least desperate: increasing price, then decreasing number of shares
-    sorted_sell_orders = sorted(
-        sell_orders, key=lambda o: (o["price"], -o["number_of_shares"])
-    )
+    sorted_sell_orders = np.lexsort((-sells.shares, sells.prices)).tolist()
 
+    passes = 0
     while len(sorted_sell_orders) > 0:
-        unmatched_sell_orders = []
-
-        for sell_order in sorted_sell_orders:
-            eligible_buy_orders = [
-                buy_order
-                for buy_order in buy_orders
-                if (buy_order["price"] >= sell_order["price"])
-                and (
-                    (buy_order["user_id"], sell_order["user_id"])
-                    not in banned_user_matches
-                )
-            ]
+        passes += 1
+        matched_sell_orders = []
 
-            if len(eligible_buy_orders) == 0:
-                unmatched_sell_orders.append(sell_order)
+        for k in sorted_sell_orders:
+            position = remaining_buy_orders.pop_most_desperate(
+                sell_prices[k], sell_shares[k], sell_users[k]
+            )
+            if position is None:
                 continue
 
-            buy_order = min(eligible_buy_orders, key=lambda o: cmp(sell_order, o))
-            result.add((buy_order["id"], sell_order["id"]))
-            buy_orders.remove(buy_order)
+            result.add((buy_ids[position], sell_ids[k]))
+            matched_sell_orders.append(k)
 
-        for sell_order in unmatched_sell_orders:
-            sorted_sell_orders.remove(sell_order)
+        sorted_sell_orders = matched_sell_orders
 
-    return result
+    if record is not None:
+        record["passes"] = passes
+
+    return result, sorted(remaining_buy_orders.positions)
+
+
+class _BuyOrderBook:
+    """
+    Buy orders grouped by price level, then by number of shares, so that the most
+    desperate buy order for a sell order is found in logarithmic time.
+    """
+
+    def __init__(self, buys, banned_pairs, number_of_sellers):
+        self.users = buys.users.tolist()
+        self.banned_pairs = banned_pairs
+        self.number_of_sellers = number_of_sellers
+        self.positions = set(range(len(buys)))
+        self.prices = SortedList()
+        # price -> number of shares -> positions in buys
+        self.levels = {}
+
+        for position, (price, shares) in enumerate(
+            zip(buys.prices.tolist(), buys.shares.tolist())
+        ):
+            if price not in self.levels:
+                self.prices.add(price)
+                self.levels[price] = SortedDict()
+            self.levels[price].setdefault(shares, SortedList()).add(position)
+
+    def pop_most_desperate(self, price, number_of_shares, seller):
+        """
+        Removes and returns the position of the most desperate buy order that can be
+        matched with a sell order of the interned seller, or None if there is none.
+        """
+        for buy_price in self.prices.irange(minimum=price, reverse=True):
+            level = self.levels[buy_price]
+            for shares, position in self._nearest(level, number_of_shares):
+                if (
+                    self.users[position] * self.number_of_sellers + seller
+                    not in self.banned_pairs
+                ):
+                    self._remove(buy_price, shares, position)
+                    return position
+
+        return None
+
+    def _nearest(self, level, number_of_shares):
+        """
+        Yields the (number of shares, position) of every buy order in the price level,
+        by nearest number of shares, then by position.
+        """
+        shares_levels = level.keys()
+        right = level.bisect_left(number_of_shares)
+        left = right - 1
+
+        while left >= 0 or right < len(shares_levels):
+            left_distance = (
+                number_of_shares - shares_levels[left] if left >= 0 else float("inf")
+            )
+            right_distance = (
+                shares_levels[right] - number_of_shares
+                if right < len(shares_levels)
+                else float("inf")
+            )
+
+            nearest = []
+            if left_distance <= right_distance:
+                nearest.append(shares_levels[left])
+                left -= 1
+            if right_distance <= left_distance:
+                nearest.append(shares_levels[right])
+                right += 1
+
+            yield from heapq.merge(
+                *(zip(repeat(shares), level[shares]) for shares in nearest),
+                key=lambda pair: pair[1],
+            )
+
+    def _remove(self, price, shares, position):
+        self.positions.remove(position)
+
+        level = self.levels[price]
+        level[shares].remove(position)
+        if len(level[shares]) == 0:
+            del level[shares]
+        if len(level) == 0:
+            del self.levels[price]
+            self.prices.remove(price)
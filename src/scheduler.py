@@ -1,10 +1,16 @@
 from apscheduler.events import EVENT_ALL
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from src.config import APP_CONFIG
 
 scheduler = AsyncIOScheduler(APP_CONFIG)
 
+# Executor of the jobs that close a round, so that they do not block the event loop
+ROUND_CLOSING_EXECUTOR = "round_closing"
+
+progress_listeners = []
+
 # See https://github.com/agronholm/apscheduler/blob/3b0d1ce3f3a607125e60cf87e0dc13f9f711cd5e/apscheduler/events.py#L9-L25
 EVENTS = {
     2 ** 0: "EVENT_SCHEDULER_STARTED",
@@ -40,3 +46,41 @@ def log_event(event):
 
 
 scheduler.add_listener(log_event, EVENT_ALL)
+
+
+def start_on_loop(loop):
+    scheduler.configure(event_loop=loop)
+    scheduler.add_executor(
+        ThreadPoolExecutor(APP_CONFIG["ACQUITY_ROUND_CLOSING_WORKERS"]),
+        ROUND_CLOSING_EXECUTOR,
+    )
+    add_progress_listener(log_progress, loop=loop)
+    scheduler.start()
+
+
+def add_progress_listener(listener, loop=None):
+    """
+    Calls listener(job_name, stage, details) whenever a job reports its progress.
+
+    Jobs on ROUND_CLOSING_EXECUTOR run on other threads. With loop, the listener is
+    called on that event loop instead of on the thread of the job.
+    """
+    if loop is not None:
+        callback = listener
+
+        def listener(*args):
+            loop.call_soon_threadsafe(callback, *args)
+
+    progress_listeners.append(listener)
+
+
+def report_progress(job_name, stage, **details):
+    for listener in progress_listeners:
+        listener(job_name, stage, details)
+
+
+def log_progress(job_name, stage, details):
+    s = [f"Job progress: job={job_name} stage={stage}"]
+    for key, value in details.items():
+        s.append(f"{key}={value}")
+    print(" ".join(s))
@@ -65,11 +65,27 @@ AUTHENTICATE_SCHEMA = {
     "redirect_uri": {"type": "string"},
     "user_type": {"type": "string", "allowed": ["buyer", "seller"]},
 }
-GET_CHATS_BY_USER_ID_SCHEMA = {
+GET_CHATS_ETAG_SCHEMA = {
     "user_id": UUID_RULE,
     "as_buyer": {"type": "boolean"},
     "as_seller": {"type": "boolean"},
 }
+GET_CHATS_BY_USER_ID_SCHEMA = {
+    **GET_CHATS_ETAG_SCHEMA,
+    "since": {"type": "number", "min": 0, "nullable": True, "required": False},
+}
+GET_CHAT_EVENTS_SCHEMA = {
+    "user_id": UUID_RULE,
+    "chat_room_id": UUID_RULE,
+    "before": {"type": "string", "nullable": True, "required": False},
+    "limit": {
+        "type": "integer",
+        "min": 1,
+        "max": 100,
+        "nullable": True,
+        "required": False,
+    },
+}
 CREATE_NEW_MESSAGE_SCHEMA = {
     "chat_room_id": UUID_RULE,
     "author_id": UUID_RULE,
@@ -1,15 +1,19 @@
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 
-import requests
-from sqlalchemy.sql import func
+from sqlalchemy import event
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import and_, func, literal, or_
 
+from src.config import APP_CONFIG
 from src.database import (
     BannedPair,
     BuyOrder,
     Chat,
     ChatRoom,
     Match,
+    MatchRun,
     Offer,
     OfferResponse,
     Round,
@@ -18,18 +22,27 @@ from src.database import (
     User,
     UserChatRoomAssociation,
     UserRequest,
+    notify,
+    run_after_commit,
     session_scope,
+    unread_chats_count,
 )
 from src.email_service import EmailService
 from src.exceptions import (
+    InvalidAuthorizationTokenException,
     InvalidRequestException,
     InvisibleUnauthorizedException,
     ResourceNotFoundException,
     ResourceNotOwnedException,
     UnauthorizedException,
-    UserProfileNotFoundException,
 )
-from src.match import match_buyers_and_sellers
+from src.linkedin import LinkedInClient
+from src.match import (
+    double_sell_orders,
+    match_buyers_and_sellers_by_security,
+    record_phase,
+)
+from src.scheduler import ROUND_CLOSING_EXECUTOR, report_progress
 from src.schemata import (
     AUTHENTICATE_SCHEMA,
     CREATE_BUY_ORDER_SCHEMA,
@@ -41,11 +54,60 @@ from src.schemata import (
     EDIT_OFFER_STATUS_SCHEMA,
     EDIT_ORDER_SCHEMA,
     GET_AUTH_URL_SHCMEA,
+    GET_CHAT_EVENTS_SCHEMA,
     GET_CHATS_BY_USER_ID_SCHEMA,
+    GET_CHATS_ETAG_SCHEMA,
     UUID_RULE,
     validate_input,
 )
-from src.utils import EMAIL_STRFTIME_FORMAT
+from src.sessions import issue_session_token, verify_session_token
+from src.utils import (
+    EMAIL_STRFTIME_FORMAT,
+    CachedValue,
+    TtlCache,
+    decode_cursor,
+    encode_cursor,
+)
+
+# User id -> user dict of the users that were loaded recently
+authenticated_users = TtlCache(
+    ttl=APP_CONFIG["ACQUITY_AUTH_CACHE_TTL"],
+    maxsize=APP_CONFIG["ACQUITY_AUTH_CACHE_SIZE"],
+)
+# Postgres channel that tells every worker to drop its cached users
+AUTHENTICATED_USERS_CHANNEL = "authenticated_users"
+
+
+# LinkedIn member id -> profile fetched from LinkedIn
+linkedin_profiles = TtlCache(
+    ttl=APP_CONFIG["ACQUITY_LINKEDIN_PROFILE_TTL"],
+    maxsize=APP_CONFIG["ACQUITY_AUTH_CACHE_SIZE"],
+)
+# Shared by every LinkedInLogin, e.g. of the HTTP API and of the chat namespace, so
+# that there is a single pool of connections to LinkedIn and of threads using them
+linkedin_client = LinkedInClient(APP_CONFIG)
+
+
+# The active round, or None, see RoundService.get_active
+active_round_cache = CachedValue()
+# Postgres channel that tells every worker to drop its cached active round
+ACTIVE_ROUND_CHANNEL = "active_round"
+
+
+def forget_active_round(session):
+    """
+    Drops the cached active round of every worker, once session commits.
+    """
+    session.info["active_round_changed"] = True
+    notify(session, ACTIVE_ROUND_CHANNEL)
+    run_after_commit(active_round_cache.clear)
+
+
+def forget_authenticated_user(user_id):
+    """
+    Drops the cached user dicts of a user, after the user changes.
+    """
+    run_after_commit(authenticated_users.discard_if, lambda user: user["id"] == user_id)
 
 
 class UserService:
@@ -101,8 +163,27 @@ class UserService:
                 user.display_image_url = display_image_url
                 user.auth_token = auth_token
 
-            session.commit()
-            return user.asdict()
+            session.flush()
+            user_dict = user.asdict()
+
+        forget_authenticated_user(user_dict["id"])
+        return user_dict
+
+    @validate_input({"id": UUID_RULE})
+    def get_user_by_id(self, id):
+        """
+        Returns the user dict of a user, cached for ACQUITY_AUTH_CACHE_TTL seconds, or
+        None if there is no such user.
+        """
+        user = authenticated_users.get(id)
+        if user is None:
+            with session_scope() as session:
+                user = session.query(User).get(id)
+                if user is None:
+                    return None
+                user = user.asdict()
+            authenticated_users.set(id, user)
+        return dict(user)
 
     def get_user_by_linkedin_id(self, provider_user_id):
         with session_scope() as session:
@@ -165,14 +246,14 @@ class SellOrderService:
             active_round = RoundService(self.config).get_active()
             if active_round is None:
                 session.add(sell_order)
-                session.commit()
+                session.flush()
                 if RoundService(self.config).should_round_start():
                     RoundService(self.config).create_new_round_and_set_orders(scheduler)
             else:
                 sell_order.round_id = active_round["id"]
                 session.add(sell_order)
 
-            session.commit()
+            session.flush()
 
             self.email_service.send_email(
                 emails=[user.email], template="create_sell_order"
@@ -219,7 +300,7 @@ class SellOrderService:
             if new_price is not None:
                 sell_order.price = new_price
 
-            session.commit()
+            session.flush()
 
             user = session.query(User).get(sell_order.user_id)
             self.email_service.send_email(
@@ -272,7 +353,7 @@ class BuyOrderService:
             )
 
             session.add(buy_order)
-            session.commit()
+            session.flush()
 
             self.email_service.send_email(
                 emails=[user.email], template="create_buy_order"
@@ -319,7 +400,7 @@ class BuyOrderService:
             if new_price is not None:
                 buy_order.price = new_price
 
-            session.commit()
+            session.flush()
 
             user = session.query(User).get(buy_order.user_id)
             self.email_service.send_email(
@@ -363,7 +444,7 @@ class SecurityService:
                 )
 
             security.market_price = market_price
-            session.commit()
+            session.flush()
             return security.asdict()
 
 
@@ -377,13 +458,30 @@ class RoundService:
             return [r.asdict() for r in session.query(Round).all()]
 
     def get_active(self):
+        """
+        Returns the active round, cached until it ends, it changes, or at most
+        ACQUITY_ACTIVE_ROUND_CACHE_TTL seconds.
+        """
+        is_cached, active_round, generation = active_round_cache.get()
+        if is_cached:
+            return active_round and dict(active_round)
+
         with session_scope() as session:
             active_round = (
                 session.query(Round)
                 .filter(Round.end_time >= datetime.now(), Round.is_concluded == False)
                 .one_or_none()
             )
-            return active_round and active_round.asdict()
+            active_round = active_round and active_round.asdict()
+            # rounds changed by this transaction are not committed yet
+            is_cacheable = not session.info.get("active_round_changed", False)
+
+        if is_cacheable:
+            expires_at = time.time() + self.config["ACQUITY_ACTIVE_ROUND_CACHE_TTL"]
+            if active_round is not None:
+                expires_at = min(expires_at, active_round["end_time"].timestamp())
+            active_round_cache.set(active_round, expires_at, generation)
+        return active_round and dict(active_round)
 
     def should_round_start(self):
         with session_scope() as session:
@@ -416,6 +514,7 @@ class RoundService:
             new_round = Round(end_time=end_time, is_concluded=False)
             session.add(new_round)
             session.flush()
+            forget_active_round(session)
 
             for sell_order in session.query(SellOrder).filter_by(round_id=None):
                 sell_order.round_id = str(new_round.id)
@@ -453,9 +552,13 @@ class RoundService:
                 "date",
                 run_date=end_time
                 - self.config["ACQUITY_ROUND_CLOSING_REMINDER_BEFORE_END_TIME"],
+                executor=ROUND_CLOSING_EXECUTOR,
             )
             scheduler.add_job(
-                MatchService(self.config).run_matches, "date", run_date=end_time
+                MatchService(self.config).run_matches,
+                "date",
+                run_date=end_time,
+                executor=ROUND_CLOSING_EXECUTOR,
             )
 
     def send_round_closing_soon_emails(self):
@@ -495,9 +598,53 @@ class MatchService:
             round_id = str(
                 session.query(Round).order_by(Round.created_at.desc()).first().id
             )
-        buy_orders, sell_orders, banned_pairs = self._get_matching_params(round_id)
+        report_progress("run_matches", "started", round_id=round_id)
 
-        match_results = match_buyers_and_sellers(buy_orders, sell_orders, banned_pairs)
+        stats = {}
+        try:
+            self._run_matches(round_id, stats)
+        except Exception as e:
+            stats["error"] = repr(e)
+            raise
+        finally:
+            with session_scope() as session:
+                session.add(MatchRun(round_id=round_id, stats=stats))
+
+        report_progress("run_matches", "finished", round_id=round_id)
+
+    def _run_matches(self, round_id, stats):
+        with record_phase(stats, "load") as record:
+            buy_orders, sell_orders, banned_pairs = self._get_matching_params(round_id)
+            record["buy_orders"] = len(buy_orders)
+            record["sell_orders"] = len(sell_orders)
+            record["banned_pairs"] = len(banned_pairs)
+
+        with record_phase(stats, "match") as record:
+            record["securities"] = {}
+            match_results = match_buyers_and_sellers_by_security(
+                buy_orders,
+                sell_orders,
+                banned_pairs,
+                max_workers=self.config["ACQUITY_MATCHING_WORKERS"],
+                stats=record["securities"],
+                solver=self.config["ACQUITY_MATCHING_SOLVER"],
+                max_edges_per_order=self.config["ACQUITY_MATCHING_MAX_EDGES_PER_ORDER"],
+                time_budget=self.config["ACQUITY_MATCHING_TIME_BUDGET"],
+            )
+            record["matches"] = len(match_results)
+
+        for security_id, security_stats in stats["match"]["securities"].items():
+            quality = security_stats["first_matching"]
+            report_progress(
+                "run_matches",
+                "matching_quality",
+                round_id=round_id,
+                security_id=security_id,
+                matches=quality["matches"],
+                max_matches=quality["max_matches"],
+                cost=quality["cost"],
+                cost_lower_bound=quality["cost_lower_bound"],
+            )
 
         buy_order_to_buyer_dict = {
             order["id"]: order["user_id"] for order in buy_orders
@@ -506,10 +653,28 @@ class MatchService:
             order["id"]: order["user_id"] for order in sell_orders
         }
 
-        self._add_db_objects(
-            round_id, match_results, sell_order_to_seller_dict, buy_order_to_buyer_dict
+        report_progress(
+            "run_matches",
+            "matched",
+            round_id=round_id,
+            buy_orders=len(buy_orders),
+            sell_orders=len(sell_orders),
+            matches=len(match_results),
         )
-        self._send_emails(buy_orders, sell_orders, match_results)
+
+        with record_phase(stats, "add_db_objects") as record:
+            record["rows_inserted"] = self._add_db_objects(
+                round_id,
+                match_results,
+                sell_order_to_seller_dict,
+                buy_order_to_buyer_dict,
+            )
+        report_progress("run_matches", "saved", round_id=round_id)
+
+        with record_phase(stats, "send_emails") as record:
+            record["emails_sent"] = self._send_emails(
+                buy_orders, sell_orders, match_results
+            )
 
     def _get_matching_params(self, round_id):
         with session_scope() as session:
@@ -531,20 +696,7 @@ class MatchService:
                 (bp.buyer_id, bp.seller_id) for bp in session.query(BannedPair).all()
             ]
 
-        return buy_orders, self._double_sell_orders(sell_orders), banned_pairs
-
-    def _double_sell_orders(self, sell_orders):
-        seller_counts = defaultdict(lambda: 0)
-        for sell_order in sell_orders:
-            seller_counts[sell_order["user_id"]] += 1
-
-        new_sell_orders = []
-        for sell_order in sell_orders:
-            new_sell_orders.append(sell_order)
-            if seller_counts[sell_order["user_id"]] == 1:
-                new_sell_orders.append(sell_order)
-
-        return new_sell_orders
+        return buy_orders, double_sell_orders(sell_orders), banned_pairs
 
     def _add_db_objects(
         self,
@@ -553,29 +705,44 @@ class MatchService:
         sell_order_to_seller_dict,
         buy_order_to_buyer_dict,
     ):
+        inserted = []
+
+        def record_insert(session, instance):
+            inserted.append(instance)
+
         with session_scope() as session:
-            for buy_order_id, sell_order_id in match_results:
-                match = Match(buy_order_id=buy_order_id, sell_order_id=sell_order_id)
-                session.add(match)
-                session.flush()
+            event.listen(session, "pending_to_persistent", record_insert)
+            try:
+                for buy_order_id, sell_order_id in match_results:
+                    match = Match(
+                        buy_order_id=buy_order_id, sell_order_id=sell_order_id
+                    )
+                    session.add(match)
+                    session.flush()
 
-                chat_room = ChatRoom(match_id=str(match.id))
-                session.add(chat_room)
-                session.flush()
+                    chat_room = ChatRoom(match_id=str(match.id))
+                    session.add(chat_room)
+                    session.flush()
 
-                buyer_assoc = UserChatRoomAssociation(
-                    user_id=buy_order_to_buyer_dict[buy_order_id],
-                    chat_room_id=str(chat_room.id),
-                    role="BUYER",
-                )
-                seller_assoc = UserChatRoomAssociation(
-                    user_id=sell_order_to_seller_dict[sell_order_id],
-                    chat_room_id=str(chat_room.id),
-                    role="SELLER",
-                )
-                session.add_all([buyer_assoc, seller_assoc])
+                    buyer_assoc = UserChatRoomAssociation(
+                        user_id=buy_order_to_buyer_dict[buy_order_id],
+                        chat_room_id=str(chat_room.id),
+                        role="BUYER",
+                    )
+                    seller_assoc = UserChatRoomAssociation(
+                        user_id=sell_order_to_seller_dict[sell_order_id],
+                        chat_room_id=str(chat_room.id),
+                        role="SELLER",
+                    )
+                    session.add_all([buyer_assoc, seller_assoc])
+
+                session.query(Round).get(round_id).is_concluded = True
+                forget_active_round(session)
+                session.flush()
+            finally:
+                event.remove(session, "pending_to_persistent", record_insert)
 
-            session.query(Round).get(round_id).is_concluded = True
+        return len(inserted)
 
     def _send_emails(self, buy_orders, sell_orders, match_results):
         matched_uuids = set()
@@ -628,6 +795,12 @@ class MatchService:
                 unmatched_emails, template="match_done_no_match"
             )
 
+        return (
+            len(matched_buyer_emails)
+            + len(matched_seller_emails)
+            + len(unmatched_emails)
+        )
+
 
 class BannedPairService:
     def __init__(self, config):
@@ -700,7 +873,6 @@ class OfferService:
                 )
 
             chat_room = session.query(ChatRoom).get(chat_room_id)
-            chat_room.updated_at = offer.created_at
             chat_room.is_deal_closed = offer_status == "ACCEPTED"
             offer.offer_status = offer_status
             session.add(offer)
@@ -709,6 +881,7 @@ class OfferService:
             offer_response = OfferResponse(offer_id=str(offer.id))
             session.add(offer_response)
             session.flush()
+            chat_room.updated_at = offer_response.created_at
 
             return OfferService._serialize_chat_offer(
                 offer=offer.asdict(),
@@ -755,18 +928,24 @@ class ChatService:
         self.email_service = EmailService(config=config)
 
     @validate_input(GET_CHATS_BY_USER_ID_SCHEMA)
-    def get_chats_by_user_id(self, user_id, as_buyer, as_seller):
-        roles = []
-        if as_buyer:
-            roles.append("BUYER")
-        if as_seller:
-            roles.append("SELLER")
+    def get_chats_by_user_id(self, user_id, as_buyer, as_seller, since=None):
+        """
+        since: if set, a watermark returned by an earlier call. Only the rooms that
+        changed after it are returned, with the events after it.
+        """
+        roles = ChatService._roles(as_buyer, as_seller)
 
         with session_scope() as session:
             user = session.query(User).get(user_id)
             if (as_buyer and (not user.can_buy)) or (as_seller and (not user.can_sell)):
                 raise UnauthorizedException("Too much permissions requested.")
 
+            # overlaps the next sync with this one, since the changes are stamped with
+            # the start of transactions that may commit after this one reads
+            watermark = session.query(func.now()).scalar() - timedelta(
+                seconds=self.config["ACQUITY_CHAT_SYNC_OVERLAP"]
+            )
+
             chat_room_queries = (
                 session.query(
                     ChatRoom, UserChatRoomAssociation, Match, BuyOrder, SellOrder
@@ -780,88 +959,95 @@ class ChatService:
                 .join(SellOrder, Match.sell_order_id == SellOrder.id)
                 .filter(UserChatRoomAssociation.user_id == user_id)
                 .filter(UserChatRoomAssociation.role.in_(roles))
-                .all()
             )
-            chats = session.query(Chat).all()
-            offers = session.query(Offer).all()
-            offer_responses = session.query(OfferResponse).all()
+            if since is not None:
+                since = datetime.fromtimestamp(since, timezone.utc)
+                # chats, offers and disbands touch the room; reveals, archives and
+                # reads touch the members
+                member = aliased(UserChatRoomAssociation)
+                chat_room_queries = chat_room_queries.filter(
+                    or_(
+                        ChatRoom.updated_at > since,
+                        session.query(member)
+                        .filter(member.chat_room_id == ChatRoom.id)
+                        .filter(member.updated_at > since)
+                        .exists(),
+                    )
+                )
+            chat_room_queries = chat_room_queries.all()
+            # the rooms of the user, so that only their rows are looked at
+            chat_room_ids = session.query(UserChatRoomAssociation.chat_room_id).filter(
+                UserChatRoomAssociation.user_id == user_id,
+                UserChatRoomAssociation.role.in_(roles),
+            )
 
             whitelist_chat_rooms = None
             if not as_seller:
+                has_chats = (
+                    session.query(Chat)
+                    .filter(Chat.chat_room_id == UserChatRoomAssociation.chat_room_id)
+                    .exists()
+                )
+                has_offers = (
+                    session.query(Offer)
+                    .filter(Offer.chat_room_id == UserChatRoomAssociation.chat_room_id)
+                    .exists()
+                )
                 whitelist_chat_rooms = set(
-                    str(r[0].id)
-                    for r in session.query(ChatRoom, Chat)
-                    .join(Chat, ChatRoom.id == Chat.chat_room_id)
-                    .all()
-                ) | set(
-                    str(r[0].id)
-                    for r in session.query(ChatRoom, Offer)
-                    .join(Offer, ChatRoom.id == Offer.chat_room_id)
-                    .all()
+                    r.chat_room_id
+                    for r in chat_room_ids.filter(or_(has_chats, has_offers)).all()
                 )
 
-            res = {}
-
+            chat_rooms = {}
+            orders = {}
             for chat_room, assoc, match, buy_order, sell_order in chat_room_queries:
                 chat_room_id = str(chat_room.id)
-                if (chat_room_id in res) or (
+                if (chat_room_id in chat_rooms) or (
                     (whitelist_chat_rooms is not None)
                     and (chat_room_id not in whitelist_chat_rooms)
                 ):
                     continue
+                chat_rooms[chat_room_id] = chat_room
+                orders[chat_room_id] = (buy_order, sell_order)
 
-                chat_room_repr = ChatRoomService(self.config)._serialize_chat_room(
-                    chat_room, user_id
-                )
-                res[chat_room_id] = chat_room_repr
+            res = ChatRoomService._serialize_chat_rooms(
+                session, list(chat_rooms.values()), user_id
+            )
+            for chat_room_id, (buy_order, sell_order) in orders.items():
                 res[chat_room_id]["buy_order"] = buy_order.asdict()
                 res[chat_room_id]["sell_order"] = (
                     sell_order.asdict() if as_seller else None
                 )
 
                 res[chat_room_id]["chats"] = []
+                res[chat_room_id]["before"] = None
                 res[chat_room_id]["latest_offer"] = None
 
-            for chat in chats:
-                if chat.chat_room_id in res:
-                    res[chat.chat_room_id]["chats"].append(
-                        {"type": "chat", **chat.asdict()}
-                    )
-
-            offer_d = {}
-            for offer in offers:
+            for chat_room_id, events in ChatService._latest_events(
+                session,
+                chat_rooms,
+                other_party_ids={
+                    chat_room_id: room["other_party_id"]
+                    for chat_room_id, room in res.items()
+                },
+                user_id=user_id,
+                limit=self.config["ACQUITY_CHAT_PAGE_SIZE"],
+                since=since,
+            ).items():
+                res[chat_room_id].update(events)
+
+            for offer in ChatService._ranked(
+                session.query(Offer),
+                Offer,
+                session.query(Offer.id).filter(
+                    Offer.chat_room_id.in_(chat_room_ids),
+                    Offer.offer_status != "REJECTED",
+                ),
+                Offer.chat_room_id,
+                limit=1,
+            ):
                 if offer.chat_room_id in res:
-                    offer_d[str(offer.id)] = offer
-
-                    res[offer.chat_room_id]["chats"].append(
-                        {"type": "offer", **offer.asdict()}
-                    )
-
-                    if offer.offer_status != "REJECTED":
-                        res[offer.chat_room_id]["latest_offer"] = offer.asdict()
-
-            for offer_resp in offer_responses:
-                offer = offer_d.get(offer_resp.offer_id)
-                if offer is None:
-                    continue
-
-                if offer.offer_status == "CANCELED":
-                    author_id = offer.author_id
-                else:
-                    author_id = ChatRoomService._get_other_party_id(
-                        chat_room_id=offer.chat_room_id, user_id=offer.author_id
-                    )
-                res[offer.chat_room_id]["chats"].append(
-                    OfferService._serialize_chat_offer(
-                        offer=offer.asdict(),
-                        is_deal_closed=chat_room.is_deal_closed,
-                        offer_response=offer_resp.asdict(),
-                        author_id=author_id,
-                    )
-                )
-
-            for v in res.values():
-                v["chats"].sort(key=lambda x: x["created_at"])
+                    res[offer.chat_room_id]["latest_offer"] = offer.asdict()
 
             archived_room_ids = set(
                 q[1].chat_room_id for q in chat_room_queries if q[1].is_archived
@@ -875,7 +1061,213 @@ class ChatService:
             else:
                 unarchived_res[chat_room_id] = room
 
-        return {"archived": archived_res, "unarchived": unarchived_res}
+        return {
+            "archived": archived_res,
+            "unarchived": unarchived_res,
+            "watermark": watermark.timestamp(),
+        }
+
+    @validate_input(GET_CHATS_ETAG_SCHEMA)
+    def get_chats_etag(self, user_id, as_buyer, as_seller):
+        """
+        Returns an ETag of the chat rooms that get_chats_by_user_id returns, which
+        changes whenever one of the rooms or their members change.
+        """
+        roles = ChatService._roles(as_buyer, as_seller)
+        member = aliased(UserChatRoomAssociation)
+
+        with session_scope() as session:
+            count, rooms_updated_at, members_updated_at = (
+                session.query(
+                    func.count(ChatRoom.id.distinct()),
+                    func.max(ChatRoom.updated_at),
+                    func.max(member.updated_at),
+                )
+                .join(
+                    UserChatRoomAssociation,
+                    UserChatRoomAssociation.chat_room_id == ChatRoom.id,
+                )
+                .join(member, member.chat_room_id == ChatRoom.id)
+                .filter(UserChatRoomAssociation.user_id == user_id)
+                .filter(UserChatRoomAssociation.role.in_(roles))
+                .one()
+            )
+
+        # weak, since the watermark of the response changes with time
+        return 'W/"{}-{}-{}-{}"'.format(
+            "-".join(roles),
+            count,
+            rooms_updated_at and rooms_updated_at.timestamp(),
+            members_updated_at and members_updated_at.timestamp(),
+        )
+
+    @staticmethod
+    def _roles(as_buyer, as_seller):
+        roles = []
+        if as_buyer:
+            roles.append("BUYER")
+        if as_seller:
+            roles.append("SELLER")
+        return roles
+
+    @validate_input(GET_CHAT_EVENTS_SCHEMA)
+    def get_chat_events(self, user_id, chat_room_id, before=None, limit=None):
+        """
+        Returns the chats, offers and offer responses of a chat room that come before
+        the `before` cursor, or the latest ones, oldest first. The returned `before`
+        cursor points at the page before that, if there is one.
+        """
+        with session_scope() as session:
+            chat_room = session.query(ChatRoom).get(chat_room_id)
+            if chat_room is None:
+                raise ResourceNotFoundException("Chat room not found")
+            chat_room_id = str(chat_room.id)
+
+            member_ids = [
+                a.user_id
+                for a in session.query(UserChatRoomAssociation)
+                .filter_by(chat_room_id=chat_room_id)
+                .all()
+            ]
+            if user_id not in member_ids:
+                raise ResourceNotOwnedException("User is not in this chat room")
+            (other_party_id,) = [id for id in member_ids if id != user_id]
+
+            return ChatService._latest_events(
+                session,
+                {chat_room_id: chat_room},
+                other_party_ids={chat_room_id: other_party_id},
+                user_id=user_id,
+                limit=limit or self.config["ACQUITY_CHAT_PAGE_SIZE"],
+                before=before and decode_cursor(before),
+            ).get(chat_room_id, {"chats": [], "before": None})
+
+    @staticmethod
+    def _latest_events(
+        session, chat_rooms, other_party_ids, user_id, limit, before=None, since=None
+    ):
+        """
+        Returns {chat_room_id: {"chats": events, "before": cursor}} with the latest
+        `limit` events of each of chat_rooms that come before `before`, which is a
+        (created_at, id), and after the `since` datetime. Rooms without such events
+        are left out.
+
+        other_party_ids: {chat_room_id: the other member of the room than user_id}
+        """
+        chat_room_ids = list(chat_rooms)
+        if len(chat_room_ids) == 0:
+            return {}
+        events = defaultdict(list)
+
+        def add(chat_room_id, event):
+            events[chat_room_id].append(event)
+
+        for chat in ChatService._ranked(
+            session.query(Chat),
+            Chat,
+            session.query(Chat.id).filter(Chat.chat_room_id.in_(chat_room_ids)),
+            Chat.chat_room_id,
+            limit=limit + 1,
+            before=before,
+            since=since,
+        ):
+            add(chat.chat_room_id, {"type": "chat", **chat.asdict()})
+
+        for offer in ChatService._ranked(
+            session.query(Offer),
+            Offer,
+            session.query(Offer.id).filter(Offer.chat_room_id.in_(chat_room_ids)),
+            Offer.chat_room_id,
+            limit=limit + 1,
+            before=before,
+            since=since,
+        ):
+            add(
+                offer.chat_room_id,
+                OfferService._serialize_chat_offer(
+                    offer=offer.asdict(),
+                    is_deal_closed=chat_rooms[offer.chat_room_id].is_deal_closed,
+                ),
+            )
+
+        for offer_resp, offer in ChatService._ranked(
+            session.query(OfferResponse, Offer).join(
+                Offer, OfferResponse.offer_id == Offer.id
+            ),
+            OfferResponse,
+            session.query(OfferResponse.id)
+            .join(Offer, OfferResponse.offer_id == Offer.id)
+            .filter(Offer.chat_room_id.in_(chat_room_ids)),
+            Offer.chat_room_id,
+            limit=limit + 1,
+            before=before,
+            since=since,
+        ):
+            if offer.offer_status == "CANCELED":
+                author_id = offer.author_id
+            elif offer.author_id == user_id:
+                author_id = other_party_ids[offer.chat_room_id]
+            else:
+                # the offer is from the other party, so the user responded to it
+                author_id = user_id
+            add(
+                offer.chat_room_id,
+                OfferService._serialize_chat_offer(
+                    offer=offer.asdict(),
+                    is_deal_closed=chat_rooms[offer.chat_room_id].is_deal_closed,
+                    offer_response=offer_resp.asdict(),
+                    author_id=author_id,
+                ),
+            )
+
+        res = {}
+        for chat_room_id, room_events in events.items():
+            room_events.sort(key=lambda e: (e["created_at"], e["id"]), reverse=True)
+            page = room_events[:limit]
+            res[chat_room_id] = {
+                "chats": page[::-1],
+                "before": (
+                    encode_cursor(page[-1]["created_at"], page[-1]["id"])
+                    if len(room_events) > limit
+                    else None
+                ),
+            }
+        return res
+
+    @staticmethod
+    def _ranked(query, model, ids_query, chat_room_id, limit, before=None, since=None):
+        """
+        Returns the rows of `query` among the `limit` latest rows of `model` in each
+        chat room, keeping only the ones before `before` and created after `since` if
+        given, newest first.
+
+        ids_query: the ids of the candidate rows of model.
+        chat_room_id: the column of the chat room of those rows.
+        """
+        if before is not None:
+            created_at, id = before
+            ids_query = ids_query.filter(
+                or_(
+                    model.created_at < created_at,
+                    and_(model.created_at == created_at, model.id < id),
+                )
+            )
+        if since is not None:
+            ids_query = ids_query.filter(model.created_at > since)
+        latest = ids_query.add_columns(
+            func.row_number()
+            .over(
+                partition_by=chat_room_id,
+                order_by=(model.created_at.desc(), model.id.desc()),
+            )
+            .label("rank")
+        ).subquery()
+        return (
+            query.join(latest, model.id == latest.c.id)
+            .filter(latest.c.rank <= limit)
+            .order_by(model.created_at.desc(), model.id.desc())
+            .all()
+        )
 
     @validate_input(CREATE_NEW_MESSAGE_SCHEMA)
     def create_new_message(self, chat_room_id, message, author_id):
@@ -906,6 +1298,17 @@ class ChatService:
             session.add(message)
             session.flush()
             chat_room.updated_at = message.created_at
+            session.query(UserChatRoomAssociation).filter(
+                UserChatRoomAssociation.chat_room_id == chat_room_id,
+                UserChatRoomAssociation.user_id != author_id,
+            ).update(
+                {
+                    UserChatRoomAssociation.unread_count: (
+                        UserChatRoomAssociation.unread_count + 1
+                    )
+                },
+                synchronize_session=False,
+            )
 
             if first_chat:
                 other_party_id = ChatRoomService._get_other_party_id(
@@ -999,9 +1402,46 @@ class ChatRoomService:
     )
     def update_last_read_id(self, user_id, chat_room_id, last_read_id):
         with session_scope() as session:
-            session.query(UserChatRoomAssociation).filter_by(
-                user_id=user_id, chat_room_id=chat_room_id
-            ).one().last_read_id = last_read_id
+            # both columns are set at once, so the chats are counted from the new
+            # last_read_id rather than from the column
+            updated = (
+                session.query(UserChatRoomAssociation)
+                .filter_by(user_id=user_id, chat_room_id=chat_room_id)
+                .update(
+                    {
+                        UserChatRoomAssociation.last_read_id: last_read_id,
+                        UserChatRoomAssociation.unread_count: unread_chats_count(
+                            session,
+                            literal(
+                                last_read_id, UserChatRoomAssociation.last_read_id.type
+                            ),
+                        ),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            if updated == 0:
+                raise ResourceNotOwnedException("User is not in this chat room")
+
+    def repair_unread_counts(self):
+        """
+        Recounts the unread chats of every member of every chat room, which
+        create_new_message and update_last_read_id keep up to date, and returns the
+        number of counts that were wrong.
+        """
+        with session_scope() as session:
+            unread_count = unread_chats_count(session)
+            repaired = (
+                session.query(UserChatRoomAssociation)
+                .filter(UserChatRoomAssociation.unread_count != unread_count)
+                .update(
+                    {UserChatRoomAssociation.unread_count: unread_count},
+                    synchronize_session=False,
+                )
+            )
+        if repaired > 0:
+            print(f"Repaired {repaired} unread counts")
+        return repaired
 
     @staticmethod
     def is_disbanded(chat_room):
@@ -1023,47 +1463,48 @@ class ChatRoomService:
 
     @staticmethod
     def _serialize_chat_room(chat_room, user_id):
-        res = ChatRoomService._chat_room_dict_with_disband_info(chat_room)
-
-        res["other_party_id"] = ChatRoomService._get_other_party_id(
-            str(chat_room.id), user_id
-        )
         with session_scope() as session:
-            assoc = (
-                session.query(UserChatRoomAssociation)
-                .filter_by(chat_room_id=str(chat_room.id), user_id=user_id)
-                .one()
-            )
-
-            res["is_revealed"] = assoc.is_revealed
+            return ChatRoomService._serialize_chat_rooms(session, [chat_room], user_id)[
+                str(chat_room.id)
+            ]
 
-            res["identities"] = None
-            everyone = (
-                session.query(UserChatRoomAssociation, User)
-                .join(User, UserChatRoomAssociation.user_id == User.id)
-                .filter(UserChatRoomAssociation.chat_room_id == str(chat_room.id))
-                .all()
-            )
-            is_all_revealed = all(a[0].is_revealed for a in everyone)
-            if is_all_revealed:
-                res["identities"] = {
-                    str(a[1].id): {"email": a[1].email, "full_name": a[1].full_name}
-                    for a in everyone
+    @staticmethod
+    def _serialize_chat_rooms(session, chat_rooms, user_id):
+        """
+        Same as {id: _serialize_chat_room(chat_room, user_id)} for chat_rooms, with
+        a single query for the members of all the rooms.
+        """
+        chat_room_ids = [str(chat_room.id) for chat_room in chat_rooms]
+        if len(chat_room_ids) == 0:
+            return {}
+
+        members = defaultdict(list)
+        for assoc, user in (
+            session.query(UserChatRoomAssociation, User)
+            .join(User, UserChatRoomAssociation.user_id == User.id)
+            .filter(UserChatRoomAssociation.chat_room_id.in_(chat_room_ids))
+            .all()
+        ):
+            members[assoc.chat_room_id].append((assoc, user))
+
+        res = {}
+        for chat_room_id, chat_room in zip(chat_room_ids, chat_rooms):
+            everyone = members[chat_room_id]
+            (assoc,) = [a for a, _ in everyone if a.user_id == user_id]
+            (other_party_id,) = [a.user_id for a, _ in everyone if a.user_id != user_id]
+
+            room = ChatRoomService._chat_room_dict_with_disband_info(chat_room)
+            room["other_party_id"] = other_party_id
+            room["is_revealed"] = assoc.is_revealed
+            room["identities"] = None
+            if all(a.is_revealed for a, _ in everyone):
+                room["identities"] = {
+                    str(user.id): {"email": user.email, "full_name": user.full_name}
+                    for _, user in everyone
                 }
-
-            last_read_id = assoc.last_read_id
-            res["last_read_id"] = last_read_id
-
-            unread_count_query = (
-                session.query(Chat)
-                .filter_by(chat_room_id=str(chat_room.id))
-                .filter(Chat.author_id != user_id)
-            )
-            if last_read_id is not None:
-                unread_count_query = unread_count_query.filter(
-                    Chat.created_at > session.query(Chat).get(last_read_id).created_at
-                )
-            res["unread_count"] = unread_count_query.count()
+            room["last_read_id"] = assoc.last_read_id
+            room["unread_count"] = assoc.unread_count
+            res[chat_room_id] = room
 
         return res
 
@@ -1079,9 +1520,18 @@ class ChatRoomService:
             )
 
 
+def repair_unread_counts():
+    """
+    Scheduled job for ChatRoomService.repair_unread_counts. The scheduler stores jobs
+    by reference, so they have to be module-level functions rather than methods.
+    """
+    return ChatRoomService(APP_CONFIG).repair_unread_counts()
+
+
 class LinkedInLogin:
     def __init__(self, config):
         self.config = config
+        self.linkedin_client = linkedin_client
 
     @validate_input(GET_AUTH_URL_SHCMEA)
     def get_auth_url(self, redirect_uri):
@@ -1090,86 +1540,91 @@ class LinkedInLogin:
 
         scope = "r_liteprofile%20r_emailaddress"
         # TODO add state
-        url = f"https://www.linkedin.com/oauth/v2/authorization?response_type={response_type}&client_id={client_id}&redirect_uri={redirect_uri[0]}&scope={scope}"
+        url = f"{self.config['LINKEDIN_OAUTH_URL']}/authorization?response_type={response_type}&client_id={client_id}&redirect_uri={redirect_uri[0]}&scope={scope}"
 
         return url
 
     @validate_input(AUTHENTICATE_SCHEMA)
     def authenticate(self, code, redirect_uri, user_type):
         is_buy = user_type == "buyer"
-        token = self._get_token(code=code, redirect_uri=redirect_uri)
-        self.get_linkedin_user(token["access_token"], is_buy=is_buy)
-        return token
+        token = self.linkedin_client.get_access_token(
+            code=code,
+            redirect_uri=redirect_uri,
+            client_id=self.config.get("CLIENT_ID"),
+            client_secret=self.config.get("CLIENT_SECRET"),
+        )
+        user = self.get_linkedin_user(token["access_token"], is_buy=is_buy)
+        return {
+            "access_token": issue_session_token(
+                user,
+                secret=self.config["ACQUITY_SESSION_SECRET"],
+                lifetime=self.config["ACQUITY_SESSION_LIFETIME"],
+            ),
+            "expires_in": self.config["ACQUITY_SESSION_LIFETIME"],
+        }
+
+    def get_authenticated_user(self, token):
+        """
+        Returns the session of a token issued by `authenticate`, with the id and
+        current capabilities of its user, or None if the user no longer exists. Does
+        not touch LinkedIn, and the database only when the user is not cached.
+        """
+        session = verify_session_token(
+            token, secret=self.config["ACQUITY_SESSION_SECRET"]
+        )
+        user = UserService(self.config).get_user_by_id(id=session["id"])
+        if user is None:
+            return None
+        if (
+            user["sessions_valid_after"] is not None
+            and session["iat"] <= user["sessions_valid_after"].timestamp()
+        ):
+            raise InvalidAuthorizationTokenException("Session expired")
+        return {
+            **session,
+            "can_buy": user["can_buy"],
+            "can_sell": user["can_sell"],
+            "is_committee": user["is_committee"],
+        }
+
+    @validate_input({"user_id": UUID_RULE})
+    def logout(self, user_id):
+        """
+        Ends every session of a user, in every worker.
+        """
+        with session_scope() as session:
+            session.query(User).get(user_id).sessions_valid_after = datetime.now(
+                timezone.utc
+            )
+            notify(session, AUTHENTICATED_USERS_CHANNEL)
+            forget_authenticated_user(user_id)
 
     def get_linkedin_user(self, token, is_buy=None):
         with session_scope() as session:
-            users = [
-                u.asdict()
-                for u in session.query(User).filter_by(auth_token=token).all()
-            ]
+            users = User.asdicts(
+                session, session.query(User).filter_by(auth_token=token).all()
+            )
 
             if len(users) == 1:
                 return users[0]
 
         return self.get_user_profile(token=token, is_buy=is_buy)
 
-    def _get_token(self, code, redirect_uri):
-        res = requests.post(
-            "https://www.linkedin.com/oauth/v2/accessToken",
-            headers={"Content-Type": "x-www-form-urlencoded"},
-            params={
-                "grant_type": "authorization_code",
-                "code": code,
-                "redirect_uri": redirect_uri,
-                "client_id": self.config.get("CLIENT_ID"),
-                "client_secret": self.config.get("CLIENT_SECRET"),
-            },
-        )
-        json_res = res.json()
-        if json_res.get("access_token") is None:
-            print(res, json_res)
-            raise UserProfileNotFoundException("Token retrieval failed.")
-        return json_res
-
     def get_user_profile(self, token, is_buy=None):
-        email_request = requests.get(
-            "https://api.linkedin.com/v2/emailAddress?q=members&projection=(elements*(handle~))",
-            headers={"Authorization": f"Bearer {token}"},
-        )
-        if email_request.status_code == 401:
-            raise UserProfileNotFoundException("User email not found.")
-        email_data = email_request.json()
-        email = email_data.get("elements")[0].get("handle~").get("emailAddress")
-
-        user_profile_request = requests.get(
-            "https://api.linkedin.com/v2/me?projection=(id,firstName,lastName,profilePicture(displayImage~:playableStreams))",
-            headers={"Authorization": f"Bearer {token}"},
-        )
-        if user_profile_request.status_code == 401:
-            raise UserProfileNotFoundException("User profile not found.")
-
-        user_profile_data = user_profile_request.json()
-        provider_user_id = user_profile_data.get("id")
-        first_name = user_profile_data.get("firstName").get("localized").get("en_US")
-        last_name = user_profile_data.get("lastName").get("localized").get("en_US")
-        try:
-            display_image_url = (
-                user_profile_data.get("profilePicture")
-                .get("displayImage~")
-                .get("elements")[-1]
-                .get("identifiers")[0]
-                .get("identifier")
-            )
-        except AttributeError:
-            display_image_url = None
+        """
+        Creates or updates the user of a LinkedIn access token. The profile is
+        fetched while the id of the member is, and only waited for if the profile of
+        the member was not fetched in the last ACQUITY_LINKEDIN_PROFILE_TTL seconds.
+        """
+        get_profile = self.linkedin_client.start_get_profile(token)
+        provider_user_id = self.linkedin_client.get_member_id(token)
+        profile = linkedin_profiles.get(provider_user_id)
+        if profile is None:
+            profile = get_profile()
+            linkedin_profiles.set(provider_user_id, profile)
 
         return UserService(self.config).create_if_not_exists(
-            email=email,
-            full_name=f"{first_name} {last_name}",
-            display_image_url=display_image_url,
-            provider_user_id=provider_user_id,
-            is_buy=is_buy,
-            auth_token=token,
+            **profile, is_buy=is_buy, auth_token=token
         )
 
 
@@ -1200,28 +1655,33 @@ class UserRequestService:
                 )
                 .all()
             )
+            user_dicts = User.asdicts(
+                session, [r[1] for r in buy_requests + sell_requests]
+            )
+            buy_user_dicts = user_dicts[: len(buy_requests)]
+            sell_user_dicts = user_dicts[len(buy_requests) :]
             return {
                 "buyers": [
                     {
                         **r[0].asdict(),
                         **{
                             k: v
-                            for k, v in r[1].asdict().items()
+                            for k, v in user_dict.items()
                             if k not in ["id", "created_at", "updated_at"]
                         },
                     }
-                    for r in buy_requests
+                    for r, user_dict in zip(buy_requests, buy_user_dicts)
                 ],
                 "sellers": [
                     {
                         **r[0].asdict(),
                         **{
                             k: v
-                            for k, v in r[1].asdict().items()
+                            for k, v in user_dict.items()
                             if k not in ["id", "created_at", "updated_at"]
                         },
                     }
-                    for r in sell_requests
+                    for r, user_dict in zip(sell_requests, sell_user_dicts)
                 ],
             }
 
@@ -1235,6 +1695,7 @@ class UserRequestService:
             request.closed_by_user_id = subject_id
 
             user = session.query(User).get(request.user_id)
+            user_id = str(user.id)
             if request.is_buy:
                 user.can_buy = True
                 self.email_service.send_email(
@@ -1246,6 +1707,9 @@ class UserRequestService:
                     emails=[user.email], template="approved_seller"
                 )
 
+            notify(session, AUTHENTICATED_USERS_CHANNEL)
+            forget_authenticated_user(user_id)
+
     @validate_input({"request_id": UUID_RULE, "subject_id": UUID_RULE})
     def reject_request(self, request_id, subject_id):
         with session_scope() as session:
@@ -1256,5 +1720,9 @@ class UserRequestService:
             request.closed_by_user_id = subject_id
 
             user = session.query(User).get(request.user_id)
+            user_id = str(user.id)
             email_template = "rejected_buyer" if request.is_buy else "rejected_seller"
             self.email_service.send_email(emails=[user.email], template=email_template)
+
+            notify(session, AUTHENTICATED_USERS_CHANNEL)
+            forget_authenticated_user(user_id)
@@ -1,5 +1,10 @@
+import base64
+import binascii
 import json
 import random
+import threading
+import time
+from collections import OrderedDict
 from collections.abc import Mapping
 from datetime import datetime
 from functools import wraps
@@ -47,3 +52,108 @@ class AcquityJson:
 
 
 EMAIL_STRFTIME_FORMAT = "%A, %B %d %Y, %I:%M %p %Z"
+
+
+def encode_cursor(created_at, id):
+    """
+    Returns an opaque, URL-safe cursor pointing at a row for keyset pagination.
+    """
+    payload = json.dumps([created_at.isoformat(), str(id)])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (created_at, id) of a cursor made by encode_cursor.
+    """
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), id
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise InvalidRequestException("Invalid cursor")
+
+
+class TtlCache:
+    """
+    Thread-safe cache that forgets entries ttl seconds after they are set, and forgets
+    the least recently used entries beyond maxsize.
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value of key, or None if there is none or it has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expiry, value = entry
+            if expiry <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard_if(self, predicate):
+        """
+        Forgets every entry whose value satisfies predicate.
+        """
+        with self._lock:
+            for key, (_, value) in list(self._entries.items()):
+                if predicate(value):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedValue:
+    """
+    Thread-safe cache of a single value, which may be None, until a time.time()
+    deadline or until it is cleared.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = None
+        # bumped by clear, so that a value loaded before a clear is not set after it
+        self._generation = 0
+
+    def get(self):
+        """
+        Returns (is_cached, value, generation), where generation is passed to set once
+        a value that is not cached has been loaded.
+        """
+        with self._lock:
+            if self._entry is not None:
+                expires_at, value = self._entry
+                if expires_at > time.time():
+                    return True, value, self._generation
+                self._entry = None
+            return False, None, self._generation
+
+    def set(self, value, expires_at, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._entry = (expires_at, value)
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+            self._generation += 1
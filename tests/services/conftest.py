@@ -1,6 +1,7 @@
 import pytest
 
 from src.database import Base, engine
+from src.services import active_round_cache, authenticated_users, linkedin_profiles
 
 
 @pytest.fixture(autouse=True)
@@ -8,3 +9,6 @@ def db():
     Base.metadata.create_all(engine)
     yield
     Base.metadata.drop_all(engine)
+    authenticated_users.clear()
+    linkedin_profiles.clear()
+    active_round_cache.clear()
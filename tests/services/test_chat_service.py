@@ -1,10 +1,17 @@
 from datetime import datetime, timedelta
+from unittest.mock import patch
 
 import pytest
+from apscheduler.util import obj_to_ref, ref_to_obj
 
 from src.config import APP_CONFIG
-from src.exceptions import UnauthorizedException
-from src.services import ChatService
+from src.exceptions import ResourceNotOwnedException, UnauthorizedException
+from src.services import (
+    ChatRoomService,
+    ChatService,
+    OfferService,
+    repair_unread_counts,
+)
 from tests.fixtures import (
     create_buy_order,
     create_chat,
@@ -16,9 +23,11 @@ from tests.fixtures import (
     create_user,
     create_user_chat_room_association,
 )
-from tests.utils import assert_dict_in
+from tests.utils import assert_dict_in, captured_queries
 
 chat_service = ChatService(config=APP_CONFIG)
+chat_room_service = ChatRoomService(config=APP_CONFIG)
+offer_service = OfferService(config=APP_CONFIG)
 
 
 def test_get_chats_by_user_id__chats():
@@ -139,6 +148,50 @@ def test_get_chats_by_user_id__offer_responses_not_in_room():
     assert "offer_resp" not in [c["type"] for c in res_chats]
 
 
+def test_get_chats_by_user_id__other_chat_rooms():
+    user = create_user("00")
+    other_party = create_user("10")
+    chat_room = create_chat_room("01")
+    create_user_chat_room_association(
+        "02",
+        user_id=user["id"],
+        chat_room_id=chat_room["id"],
+        is_archived=False,
+        role="BUYER",
+    )
+    create_user_chat_room_association(
+        "12", user_id=other_party["id"], chat_room_id=chat_room["id"], role="SELLER"
+    )
+    chat = create_chat("03", chat_room_id=chat_room["id"], author_id=other_party["id"])
+
+    third_party = create_user("20")
+    other_chat_room = create_chat_room("11")
+    create_user_chat_room_association(
+        "22",
+        user_id=third_party["id"],
+        chat_room_id=other_chat_room["id"],
+        role="BUYER",
+    )
+    create_user_chat_room_association(
+        "32",
+        user_id=other_party["id"],
+        chat_room_id=other_chat_room["id"],
+        role="SELLER",
+    )
+    create_chat("13", chat_room_id=other_chat_room["id"], author_id=third_party["id"])
+    other_offer = create_offer(
+        "14", chat_room_id=other_chat_room["id"], author_id=third_party["id"]
+    )
+    create_offer_response("15", offer_id=other_offer["id"])
+
+    res = chat_service.get_chats_by_user_id(
+        user_id=user["id"], as_buyer=True, as_seller=False
+    )
+
+    assert list(res["unarchived"]) == [chat_room["id"]]
+    assert res["unarchived"][chat_room["id"]]["chats"] == [{**chat, "type": "chat"}]
+
+
 def test_get_chats_by_user_id__archived():
     user = create_user("00")
     other_party = create_user("10")
@@ -374,7 +427,10 @@ def test_get_chats_by_user_id__last_read_id_none():
         last_read_id=None,
     )
 
-    create_chat("03", chat_room_id=chat_room["id"], author_id=other_party["id"])
+    with patch("src.services.EmailService.send_email"):
+        chat_service.create_new_message(
+            chat_room_id=chat_room["id"], message="a", author_id=other_party["id"]
+        )
 
     res = chat_service.get_chats_by_user_id(
         user_id=user["id"], as_buyer=True, as_seller=True
@@ -520,3 +576,299 @@ def test_get_chats_by_user_id__hidden_buy_order():
         user_id=user["id"], as_buyer=True, as_seller=False
     )
     assert res["unarchived"][chat_room["id"]]["sell_order"] is None
+
+
+def test_get_chats_by_user_id__constant_queries():
+    user = create_user("00")
+    other_party = create_user("10")
+
+    def create_room(id):
+        chat_room = create_chat_room(f"{id}1")
+        create_user_chat_room_association(
+            f"{id}2", user_id=user["id"], chat_room_id=chat_room["id"]
+        )
+        create_user_chat_room_association(
+            f"{id}3", user_id=other_party["id"], chat_room_id=chat_room["id"]
+        )
+        create_chat(f"{id}4", chat_room_id=chat_room["id"], author_id=other_party["id"])
+        offer = create_offer(
+            f"{id}5", chat_room_id=chat_room["id"], author_id=user["id"]
+        )
+        create_offer_response(f"{id}6", offer_id=offer["id"])
+
+    def count_queries():
+        with captured_queries() as queries:
+            chat_service.get_chats_by_user_id(
+                user_id=user["id"], as_buyer=True, as_seller=True
+            )
+        return len(queries)
+
+    create_room(0)
+    queries_for_one_room = count_queries()
+    create_room(1)
+    create_room(2)
+    assert count_queries() == queries_for_one_room
+
+
+def create_chat_room_with_events():
+    user = create_user("00")
+    other_party = create_user("10")
+    chat_room = create_chat_room("01")
+    create_user_chat_room_association(
+        "02", user_id=user["id"], chat_room_id=chat_room["id"], is_archived=False
+    )
+    create_user_chat_room_association(
+        "12", user_id=other_party["id"], chat_room_id=chat_room["id"]
+    )
+
+    start = datetime.now() - timedelta(hours=1)
+    events = []
+    for i in range(3):
+        events.append(
+            create_chat(
+                f"{i}3",
+                chat_room_id=chat_room["id"],
+                author_id=user["id"],
+                created_at=start + timedelta(minutes=3 * i),
+            )
+        )
+        offer = create_offer(
+            f"{i}4",
+            chat_room_id=chat_room["id"],
+            author_id=other_party["id"],
+            created_at=start + timedelta(minutes=3 * i + 1),
+        )
+        events.append(offer)
+        events.append(
+            create_offer_response(
+                f"{i}5",
+                offer_id=offer["id"],
+                created_at=start + timedelta(minutes=3 * i + 2),
+            )
+        )
+    return user, chat_room, [e["id"] for e in events]
+
+
+def test_get_chat_events():
+    user, chat_room, event_ids = create_chat_room_with_events()
+
+    res = chat_service.get_chat_events(
+        user_id=user["id"], chat_room_id=chat_room["id"], limit=4
+    )
+    assert [e["id"] for e in res["chats"]] == event_ids[-4:]
+    # the user responded to the offers of the other party
+    assert res["chats"][-1]["type"] == "offer_response"
+    assert res["chats"][-1]["author_id"] == user["id"]
+
+    res = chat_service.get_chat_events(
+        user_id=user["id"], chat_room_id=chat_room["id"], before=res["before"], limit=4
+    )
+    assert [e["id"] for e in res["chats"]] == event_ids[1:5]
+
+    res = chat_service.get_chat_events(
+        user_id=user["id"], chat_room_id=chat_room["id"], before=res["before"], limit=4
+    )
+    assert [e["id"] for e in res["chats"]] == event_ids[:1]
+    assert res["before"] is None
+
+
+def test_get_chat_events__not_in_room():
+    _, chat_room, _ = create_chat_room_with_events()
+    stranger = create_user("20")
+
+    with pytest.raises(ResourceNotOwnedException):
+        chat_service.get_chat_events(
+            user_id=stranger["id"], chat_room_id=chat_room["id"]
+        )
+
+
+def test_get_chats_by_user_id__latest_page():
+    user, chat_room, event_ids = create_chat_room_with_events()
+
+    small_pages = ChatService(config={**APP_CONFIG, "ACQUITY_CHAT_PAGE_SIZE": 4})
+
+    res_room = small_pages.get_chats_by_user_id(
+        user_id=user["id"], as_buyer=True, as_seller=True
+    )["unarchived"][chat_room["id"]]
+    assert [e["id"] for e in res_room["chats"]] == event_ids[-4:]
+    assert res_room["latest_offer"]["id"] == event_ids[-2]
+
+    res = chat_service.get_chat_events(
+        user_id=user["id"], chat_room_id=chat_room["id"], before=res_room["before"]
+    )
+    assert [e["id"] for e in res["chats"]] == event_ids[:-4]
+    assert res["before"] is None
+
+
+def get_unread_count(user_id, chat_room_id):
+    return chat_service.get_chats_by_user_id(
+        user_id=user_id, as_buyer=True, as_seller=True
+    )["unarchived"][chat_room_id]["unread_count"]
+
+
+def test_unread_count():
+    user = create_user("00")
+    other_party = create_user("10")
+    chat_room = create_chat_room("01")
+    create_user_chat_room_association(
+        "02", user_id=user["id"], chat_room_id=chat_room["id"]
+    )
+    create_user_chat_room_association(
+        "12", user_id=other_party["id"], chat_room_id=chat_room["id"]
+    )
+
+    with patch("src.services.EmailService.send_email"):
+        chats = [
+            chat_service.create_new_message(
+                chat_room_id=chat_room["id"], message=str(i), author_id=author["id"]
+            )
+            for i, author in enumerate([other_party, other_party, user, other_party])
+        ]
+    assert get_unread_count(user["id"], chat_room["id"]) == 3
+    assert get_unread_count(other_party["id"], chat_room["id"]) == 1
+
+    chat_room_service.update_last_read_id(
+        user_id=user["id"], chat_room_id=chat_room["id"], last_read_id=chats[1]["id"]
+    )
+    assert get_unread_count(user["id"], chat_room["id"]) == 1
+
+    chat_room_service.update_last_read_id(
+        user_id=user["id"], chat_room_id=chat_room["id"], last_read_id=chats[3]["id"]
+    )
+    assert get_unread_count(user["id"], chat_room["id"]) == 0
+
+
+def test_repair_unread_counts():
+    user = create_user("00")
+    other_party = create_user("10")
+    chat_room = create_chat_room("01")
+    chat = create_chat("03", chat_room_id=chat_room["id"], author_id=other_party["id"])
+    create_chat("04", chat_room_id=chat_room["id"], author_id=other_party["id"])
+    create_user_chat_room_association(
+        "02", user_id=user["id"], chat_room_id=chat_room["id"], unread_count=5
+    )
+    create_user_chat_room_association(
+        "12",
+        user_id=other_party["id"],
+        chat_room_id=chat_room["id"],
+        last_read_id=chat["id"],
+    )
+
+    assert chat_room_service.repair_unread_counts() == 1
+    assert get_unread_count(user["id"], chat_room["id"]) == 2
+    assert get_unread_count(other_party["id"], chat_room["id"]) == 0
+    assert chat_room_service.repair_unread_counts() == 0
+
+
+def test_repair_unread_counts__job():
+    # jobs are stored by reference, and have to load back as the same function
+    assert ref_to_obj(obj_to_ref(repair_unread_counts)) is repair_unread_counts
+
+    create_user_chat_room_association(unread_count=5)
+    assert repair_unread_counts() == 1
+
+
+def test_get_chats_by_user_id__since():
+    user = create_user("00")
+    other_party = create_user("10")
+    chat_rooms = []
+    for i in range(2):
+        chat_room = create_chat_room(f"{i}1")
+        create_user_chat_room_association(
+            f"{i}2", user_id=user["id"], chat_room_id=chat_room["id"]
+        )
+        create_user_chat_room_association(
+            f"{i}3", user_id=other_party["id"], chat_room_id=chat_room["id"]
+        )
+        create_chat(f"{i}4", chat_room_id=chat_room["id"], author_id=user["id"])
+        chat_rooms.append(chat_room)
+    offer = create_offer(
+        "05", chat_room_id=chat_rooms[1]["id"], author_id=other_party["id"]
+    )
+
+    no_overlap = ChatService(config={**APP_CONFIG, "ACQUITY_CHAT_SYNC_OVERLAP": 0})
+    res = no_overlap.get_chats_by_user_id(
+        user_id=user["id"], as_buyer=True, as_seller=True
+    )
+    assert len(res["unarchived"]) == 2
+
+    res = no_overlap.get_chats_by_user_id(
+        user_id=user["id"], as_buyer=True, as_seller=True, since=res["watermark"]
+    )
+    assert len(res["unarchived"]) == 0
+
+    with patch("src.services.EmailService.send_email"):
+        chat = chat_service.create_new_message(
+            chat_room_id=chat_rooms[1]["id"], message="a", author_id=other_party["id"]
+        )
+    res = no_overlap.get_chats_by_user_id(
+        user_id=user["id"], as_buyer=True, as_seller=True, since=res["watermark"]
+    )
+    assert list(res["unarchived"]) == [chat_rooms[1]["id"]]
+    assert res["unarchived"][chat_rooms[1]["id"]]["chats"] == [chat]
+    assert res["unarchived"][chat_rooms[1]["id"]]["unread_count"] == 1
+
+    chat_room_service.reveal_identity(
+        chat_room_id=chat_rooms[0]["id"], user_id=other_party["id"]
+    )
+    res = no_overlap.get_chats_by_user_id(
+        user_id=user["id"], as_buyer=True, as_seller=True, since=res["watermark"]
+    )
+    assert list(res["unarchived"]) == [chat_rooms[0]["id"]]
+    assert res["unarchived"][chat_rooms[0]["id"]]["chats"] == []
+
+    offer_response = offer_service.edit_offer_status(
+        chat_room_id=chat_rooms[1]["id"],
+        offer_id=offer["id"],
+        user_id=user["id"],
+        offer_status="ACCEPTED",
+    )
+    res = no_overlap.get_chats_by_user_id(
+        user_id=user["id"], as_buyer=True, as_seller=True, since=res["watermark"]
+    )
+    assert list(res["unarchived"]) == [chat_rooms[1]["id"]]
+    res_room = res["unarchived"][chat_rooms[1]["id"]]
+    assert res_room["is_deal_closed"]
+    assert res_room["chats"] == [offer_response]
+
+
+def test_get_chats_etag():
+    user = create_user("00")
+    other_party = create_user("10")
+    chat_room = create_chat_room("01")
+    create_user_chat_room_association(
+        "02", user_id=user["id"], chat_room_id=chat_room["id"]
+    )
+    create_user_chat_room_association(
+        "12", user_id=other_party["id"], chat_room_id=chat_room["id"]
+    )
+    offer = create_offer(
+        "03", chat_room_id=chat_room["id"], author_id=other_party["id"]
+    )
+
+    def get_etag():
+        return chat_service.get_chats_etag(
+            user_id=user["id"], as_buyer=True, as_seller=True
+        )
+
+    etag = get_etag()
+    assert get_etag() == etag
+
+    with patch("src.services.EmailService.send_email"):
+        chat_service.create_new_message(
+            chat_room_id=chat_room["id"], message="a", author_id=other_party["id"]
+        )
+    assert get_etag() != etag
+
+    etag = get_etag()
+    chat_room_service.archive_room(user_id=user["id"], chat_room_id=chat_room["id"])
+    assert get_etag() != etag
+
+    etag = get_etag()
+    offer_service.edit_offer_status(
+        chat_room_id=chat_room["id"],
+        offer_id=offer["id"],
+        user_id=user["id"],
+        offer_status="REJECTED",
+    )
+    assert get_etag() != etag
@@ -1,7 +1,13 @@
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+
+import pytest
 
 from src.config import APP_CONFIG
+from src.database import User, session_scope
+from src.exceptions import InvalidAuthorizationTokenException
 from src.services import LinkedInLogin
+from tests.fixtures import create_user
+from tests.utils import assert_dict_in
 
 linkedin_login = LinkedInLogin(
     config={
@@ -12,6 +18,10 @@ linkedin_login = LinkedInLogin(
 )
 
 
+def test_linkedin_client():
+    assert LinkedInLogin(APP_CONFIG).linkedin_client is linkedin_login.linkedin_client
+
+
 def test_get_auth_url():
     assert (
         linkedin_login.get_auth_url(redirect_uri=["some_redirect_uri"])
@@ -20,17 +30,30 @@ def test_get_auth_url():
 
 
 def test_authenticate():
-    with patch("src.services.requests.post") as post_mock, patch(
-        "src.services.requests.get"
-    ), patch("src.services.UserService.create_if_not_exists") as user_mock:
-        post_mock.return_value.json = lambda: {"access_token": "some_access_token"}
+    with patch("src.linkedin.requests.Session.request") as request_mock, patch(
+        "src.services.LinkedInClient.get_member_id"
+    ), patch(
+        "src.services.LinkedInClient.start_get_profile", return_value=lambda: {}
+    ), patch(
+        "src.services.UserService.create_if_not_exists"
+    ) as user_mock:
+        request_mock.return_value.json = lambda: {"access_token": "some_access_token"}
+
+        user_mock.return_value = create_user(can_buy=False)
 
-        assert linkedin_login.authenticate(
+        token = linkedin_login.authenticate(
             code="some_code", redirect_uri="some_redirect_uri", user_type="buyer"
-        ) == {"access_token": "some_access_token"}
+        )
+        assert token["expires_in"] == APP_CONFIG["ACQUITY_SESSION_LIFETIME"]
+        assert (
+            linkedin_login.get_authenticated_user(token=token["access_token"])["id"]
+            == user_mock.return_value["id"]
+        )
 
-        post_mock.assert_any_call(
+        request_mock.assert_any_call(
+            "post",
             "https://www.linkedin.com/oauth/v2/accessToken",
+            timeout=APP_CONFIG["LINKEDIN_TIMEOUT"],
             headers={"Content-Type": "x-www-form-urlencoded"},
             params={
                 "grant_type": "authorization_code",
@@ -45,3 +68,75 @@ def test_authenticate():
         create_kwargs = user_mock.call_args[1]
         assert create_kwargs["is_buy"]
         assert create_kwargs["auth_token"] == "some_access_token"
+
+
+def authenticate(user):
+    with patch(
+        "src.services.LinkedInClient.get_access_token",
+        return_value={"access_token": "some_access_token"},
+    ), patch("src.services.LinkedInClient.get_member_id"), patch(
+        "src.services.LinkedInClient.start_get_profile", return_value=lambda: {}
+    ), patch(
+        "src.services.UserService.create_if_not_exists", return_value=user
+    ):
+        return linkedin_login.authenticate(
+            code="some_code", redirect_uri="some_redirect_uri", user_type="buyer"
+        )["access_token"]
+
+
+def test_get_authenticated_user():
+    user = create_user(can_buy=True)
+    token = authenticate(user)
+
+    with patch("src.linkedin.requests.Session.request") as request_mock:
+        session = linkedin_login.get_authenticated_user(token=token)
+        request_mock.assert_not_called()
+    assert_dict_in(
+        {key: user[key] for key in ["id", "can_buy", "can_sell", "is_committee"]},
+        session,
+    )
+
+    with patch("src.services.session_scope") as session_mock:
+        linkedin_login.get_authenticated_user(token=token)
+        session_mock.assert_not_called()
+
+    linkedin_login.logout(user_id=user["id"])
+    with pytest.raises(InvalidAuthorizationTokenException):
+        linkedin_login.get_authenticated_user(token=token)
+
+    assert (
+        linkedin_login.get_authenticated_user(token=authenticate(user))["id"]
+        == user["id"]
+    )
+
+
+def test_get_authenticated_user__deleted_user():
+    user = create_user()
+    token = authenticate(user)
+
+    with session_scope() as session:
+        session.query(User).filter_by(id=user["id"]).delete()
+
+    assert linkedin_login.get_authenticated_user(token=token) is None
+
+
+def test_get_user_profile():
+    profile = {
+        "email": "a@a.com",
+        "full_name": "A A",
+        "display_image_url": None,
+        "provider_user_id": "abcdef",
+    }
+    get_profile = Mock(return_value=profile)
+    with patch(
+        "src.services.LinkedInClient.get_member_id", return_value="abcdef"
+    ), patch(
+        "src.services.LinkedInClient.start_get_profile", return_value=get_profile
+    ), patch(
+        "src.services.UserService.create_if_not_exists"
+    ) as user_mock:
+        linkedin_login.get_user_profile(token="some_token", is_buy=True)
+        linkedin_login.get_user_profile(token="other_token")
+
+        get_profile.assert_called_once_with()
+        user_mock.assert_called_with(**profile, is_buy=None, auth_token="other_token")
@@ -1,12 +1,13 @@
 from unittest.mock import call, patch
 
 from src.config import APP_CONFIG
-from src.database import Match, Round, UserChatRoomAssociation, session_scope
+from src.database import Match, MatchRun, Round, UserChatRoomAssociation, session_scope
 from src.services import MatchService
 from tests.fixtures import (
     create_banned_pair,
     create_buy_order,
     create_round,
+    create_security,
     create_sell_order,
     create_user,
 )
@@ -30,7 +31,7 @@ def test_run_matches():
     create_sell_order("4", round_id=round["id"], user_id=sell_user2["id"])
 
     with patch(
-        "src.services.match_buyers_and_sellers",
+        "src.services.match_buyers_and_sellers_by_security",
         return_value=[(buy_order_id, sell_order_id)],
     ) as mock_match, patch(
         "src.services.RoundService.get_active", return_value=round
@@ -89,9 +90,13 @@ def test_run_matches__cannot_buy_or_sell():
     create_sell_order("3", round_id=round["id"], user_id=sell_user["id"])
     create_sell_order("4", round_id=round["id"], user_id=sell_user2["id"])
 
-    with patch("src.services.match_buyers_and_sellers") as mock_match, patch(
+    with patch(
+        "src.services.match_buyers_and_sellers_by_security"
+    ) as mock_match, patch(
         "src.services.RoundService.get_active", return_value=round
-    ), patch("src.services.EmailService.send_email"):
+    ), patch(
+        "src.services.EmailService.send_email"
+    ):
         match_service.run_matches()
 
         assert set(u["user_id"] for u in mock_match.call_args[0][0]) == set(
@@ -103,6 +108,32 @@ def test_run_matches__cannot_buy_or_sell():
         assert mock_match.call_args[0][2] == []
 
 
+def test_run_matches__by_security():
+    round = create_round()
+    security = create_security("1")
+    security2 = create_security("2")
+
+    buy_order = create_buy_order(
+        "1", round_id=round["id"], security_id=security["id"], price=10
+    )
+    # Would be matched with the sell orders if it were for the same security
+    create_buy_order("2", round_id=round["id"], security_id=security2["id"], price=20)
+    sell_order = create_sell_order(
+        "3", round_id=round["id"], security_id=security["id"], price=8
+    )
+    create_sell_order("4", round_id=round["id"], security_id=security["id"], price=6)
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        match_service.run_matches()
+
+    with session_scope() as session:
+        match = session.query(Match).one()
+        assert match.buy_order_id == buy_order["id"]
+        assert match.sell_order_id == sell_order["id"]
+
+
 def test_run_matches__banned_pairs():
     round = create_round()
 
@@ -121,9 +152,13 @@ def test_run_matches__banned_pairs():
 
     create_banned_pair(buyer_id=buy_user_id, seller_id=sell_user_id)
 
-    with patch("src.services.match_buyers_and_sellers") as mock_match, patch(
+    with patch(
+        "src.services.match_buyers_and_sellers_by_security"
+    ) as mock_match, patch(
         "src.services.RoundService.get_active", return_value=round
-    ), patch("src.services.EmailService.send_email"):
+    ), patch(
+        "src.services.EmailService.send_email"
+    ):
         match_service.run_matches()
 
         assert set(u["user_id"] for u in mock_match.call_args[0][0]) == set(
@@ -149,9 +184,13 @@ def test_run_matches__double_sell_orders():
         "5", round_id=round["id"], user_id=sell_user2["id"]
     )
 
-    with patch("src.services.match_buyers_and_sellers") as mock_match, patch(
+    with patch(
+        "src.services.match_buyers_and_sellers_by_security"
+    ) as mock_match, patch(
         "src.services.RoundService.get_active", return_value=round
-    ), patch("src.services.EmailService.send_email"):
+    ), patch(
+        "src.services.EmailService.send_email"
+    ):
         match_service.run_matches()
 
         assert (
@@ -170,3 +209,41 @@ def test_run_matches__double_sell_orders():
             )
             == 1
         )
+
+
+def test_run_matches__match_run():
+    round = create_round()
+
+    buy_user = create_user("1")
+    sell_user = create_user("2")
+    security_id = create_security()["id"]
+    for create_order, user in [
+        (create_buy_order, buy_user),
+        (create_sell_order, sell_user),
+    ]:
+        create_order(
+            round_id=round["id"],
+            user_id=user["id"],
+            security_id=security_id,
+            number_of_shares=20,
+            price=10,
+        )
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        match_service.run_matches()
+
+    with session_scope() as session:
+        match_run = session.query(MatchRun).one().asdict()
+
+    assert match_run["round_id"] == round["id"]
+    stats = match_run["stats"]
+    assert stats["load"]["buy_orders"] == 1
+    assert stats["load"]["sell_orders"] == 2
+    assert stats["match"]["matches"] == 1
+    assert stats["match"]["securities"][security_id]["generate_edges"]["edges"] == 1
+    assert stats["add_db_objects"]["rows_inserted"] == 4
+    assert stats["send_emails"]["emails_sent"] == 2
+    for phase in ["load", "match", "add_db_objects", "send_emails"]:
+        assert stats[phase]["wall_time"] >= 0
@@ -0,0 +1,140 @@
+import uuid
+from datetime import datetime, timedelta
+
+from src.config import APP_CONFIG
+from src.database import BuyOrder, Round, Security, SellOrder, User, UserRequest, engine
+from src.services import (
+    BuyOrderService,
+    LinkedInLogin,
+    RoundService,
+    SellOrderService,
+    UserService,
+)
+from tests.utils import captured_queries
+
+NUMBER_OF_USERS = 2000
+NUMBER_OF_ROUNDS = 2000
+ORDERS_PER_USER = 5
+
+# tables that the seeded database makes too large to scan
+LARGE_TABLES = {"users", "rounds", "sell_orders", "buy_orders", "user_requests"}
+
+
+def seed_large_database():
+    now = datetime.now()
+    security_id = uuid.uuid4()
+    user_ids = [uuid.uuid4() for _ in range(NUMBER_OF_USERS)]
+    round_ids = [uuid.uuid4() for _ in range(NUMBER_OF_ROUNDS)]
+
+    users = [
+        {
+            "id": user_id,
+            "email": f"a{i}@a",
+            "provider": "linkedin",
+            "full_name": f"a{i}",
+            "provider_user_id": f"abcdef{i}",
+            "auth_token": f"token{i}",
+            "can_buy": i % 2 == 0,
+            "can_sell": True,
+        }
+        for i, user_id in enumerate(user_ids)
+    ]
+    rounds = [
+        {
+            "id": round_id,
+            "end_time": now - timedelta(days=NUMBER_OF_ROUNDS - i),
+            "is_concluded": True,
+        }
+        for i, round_id in enumerate(round_ids)
+    ]
+    rounds[-1].update(end_time=now + timedelta(days=1), is_concluded=False)
+    orders = [
+        {
+            "id": uuid.uuid4(),
+            "user_id": str(user_id),
+            "security_id": str(security_id),
+            "number_of_shares": 20 + j,
+            "price": 30 + j,
+            # only a few orders wait for the next round
+            "round_id": None if (i + j) % 500 == 0 else str(round_ids[(i + j) % 1000]),
+        }
+        for i, user_id in enumerate(user_ids)
+        for j in range(ORDERS_PER_USER)
+    ]
+    user_requests = [
+        {
+            "id": uuid.uuid4(),
+            "user_id": str(user_id),
+            "is_buy": is_buy,
+            "closed_by_user_id": None if i % 100 == 0 else str(user_ids[0]),
+        }
+        for i, user_id in enumerate(user_ids)
+        for is_buy in [True, False]
+    ]
+
+    with engine.begin() as connection:
+        connection.execute(
+            Security.__table__.insert(), [{"id": security_id, "name": "a"}]
+        )
+        connection.execute(User.__table__.insert(), users)
+        connection.execute(Round.__table__.insert(), rounds)
+        connection.execute(SellOrder.__table__.insert(), orders)
+        connection.execute(BuyOrder.__table__.insert(), orders)
+        connection.execute(UserRequest.__table__.insert(), user_requests)
+        connection.execute("ANALYZE")
+
+    return [str(user_id) for user_id in user_ids]
+
+
+def sequentially_scanned_tables(statement, parameters):
+    with engine.connect() as connection:
+        plan = connection.execute(
+            f"EXPLAIN (FORMAT JSON) {statement}", parameters
+        ).scalar()
+
+    tables = set()
+    nodes = [plan[0]["Plan"]]
+    while len(nodes) > 0:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan":
+            tables.add(node["Relation Name"])
+        nodes.extend(node.get("Plans", []))
+    return tables
+
+
+def assert_no_sequential_scans(queries):
+    assert len(queries) > 0
+    for statement, parameters in queries:
+        scanned = sequentially_scanned_tables(statement, parameters) & LARGE_TABLES
+        assert scanned == set(), statement
+
+
+def test_query_plans__users():
+    user_ids = seed_large_database()
+
+    with captured_queries() as queries:
+        LinkedInLogin(APP_CONFIG).get_linkedin_user(token="token7")
+        UserService(APP_CONFIG).get_user_by_id(id=user_ids[7])
+    assert_no_sequential_scans(queries)
+
+
+def test_query_plans__orders():
+    user_ids = seed_large_database()
+
+    with captured_queries() as queries:
+        SellOrderService(APP_CONFIG).get_orders_by_user_in_current_round(
+            user_id=user_ids[7]
+        )
+        BuyOrderService(APP_CONFIG).get_orders_by_user_in_current_round(
+            user_id=user_ids[7]
+        )
+    assert_no_sequential_scans(queries)
+
+
+def test_query_plans__rounds():
+    seed_large_database()
+
+    with captured_queries() as queries:
+        RoundService(APP_CONFIG).get_active()
+        RoundService(APP_CONFIG).should_round_start()
+    assert_no_sequential_scans(queries)
@@ -1,7 +1,8 @@
 from datetime import datetime, timedelta
+from unittest.mock import patch
 
 from src.config import APP_CONFIG
-from src.services import RoundService
+from src.services import RoundService, active_round_cache
 from tests.fixtures import create_round, create_sell_order
 
 round_service = RoundService(config=APP_CONFIG)
@@ -24,6 +25,26 @@ def test_get_active():
     assert active_round["id"] == active_id
 
 
+def test_get_active__cached():
+    assert round_service.get_active() is None
+
+    with patch("src.services.session_scope") as session_mock:
+        assert round_service.get_active() is None
+        session_mock.assert_not_called()
+
+    with patch("src.services.EmailService.send_email"):
+        round_service.create_new_round_and_set_orders(scheduler=None)
+    active_round = round_service.get_active()
+    assert active_round is not None
+    assert active_round_cache.get()[0]
+
+    # expires when the round ends
+    with patch(
+        "src.utils.time.time", return_value=active_round["end_time"].timestamp()
+    ):
+        assert not active_round_cache.get()[0]
+
+
 def test_get_active__all_in_the_past():
     create_round(end_time=datetime.now() - timedelta(weeks=1), is_concluded=True)
     create_round(end_time=datetime.now() - timedelta(weeks=2), is_concluded=False)
@@ -1,9 +1,11 @@
+from unittest.mock import ANY, patch
+
 import pytest
 
 from src.config import APP_CONFIG
 from src.database import User, UserRequest, session_scope
 from src.exceptions import InvisibleUnauthorizedException
-from src.services import UserRequestService
+from src.services import AUTHENTICATED_USERS_CHANNEL, UserRequestService
 from tests.fixtures import create_user, create_user_request
 
 user_request_service = UserRequestService(config=APP_CONFIG)
@@ -91,6 +93,25 @@ def test_approve_request__unauthorized():
         )
 
 
+def test_approve_and_reject_request__notify():
+    admin = create_user("1", is_committee=True)
+    user = create_user("2", can_buy=False, can_sell=False)
+    buy_req = create_user_request(user_id=user["id"], is_buy=True)
+    sell_req = create_user_request(user_id=user["id"], is_buy=False)
+
+    with patch("src.services.notify") as notify_mock:
+        user_request_service.approve_request(
+            request_id=buy_req["id"], subject_id=admin["id"]
+        )
+        notify_mock.assert_called_once_with(ANY, AUTHENTICATED_USERS_CHANNEL)
+
+    with patch("src.services.notify") as notify_mock:
+        user_request_service.reject_request(
+            request_id=sell_req["id"], subject_id=admin["id"]
+        )
+        notify_mock.assert_called_once_with(ANY, AUTHENTICATED_USERS_CHANNEL)
+
+
 def test_reject_request():
     admin = create_user("1", is_committee=True)
 
@@ -2,8 +2,8 @@ from unittest.mock import patch
 
 from src.config import APP_CONFIG
 from src.database import User, UserRequest, session_scope
-from src.services import UserService
-from tests.fixtures import create_user
+from src.services import UserRequestService, UserService
+from tests.fixtures import create_user, create_user_request
 from tests.utils import assert_dict_in
 
 user_service = UserService(config=APP_CONFIG)
@@ -106,3 +106,48 @@ def test_get_user_by_linkedin_id():
 
     user = user_service.get_user_by_linkedin_id(provider_user_id="abcdef")
     assert user_params == user
+
+
+def test_get_user_by_id():
+    user = create_user(can_buy=False)
+    committee_id = create_user("1", is_committee=True)["id"]
+    request_id = create_user_request(user_id=user["id"], is_buy=True)["id"]
+
+    assert user_service.get_user_by_id(id=user["id"])["can_buy"] == "UNAPPROVED"
+
+    with patch("src.services.session_scope") as session_mock:
+        assert user_service.get_user_by_id(
+            id=user["id"]
+        ) == user_service.get_user_by_id(id=user["id"])
+        session_mock.assert_not_called()
+
+    with patch("src.services.EmailService.send_email"):
+        UserRequestService(APP_CONFIG).approve_request(
+            request_id=request_id, subject_id=committee_id
+        )
+
+    assert user_service.get_user_by_id(id=user["id"])["can_buy"] == "YES"
+
+
+def test_user_asdicts():
+    approved_user_id = create_user("1", can_buy=True, can_sell=True)["id"]
+    pending_user_id = create_user("2", can_buy=False, can_sell=False)["id"]
+    create_user_request(user_id=pending_user_id, is_buy=False)
+    closed_user_id = create_user("3", can_buy=False, can_sell=False)["id"]
+    create_user_request(
+        user_id=closed_user_id, is_buy=True, closed_by_user_id=approved_user_id
+    )
+
+    with session_scope() as session:
+        users = [
+            session.query(User).get(user_id)
+            for user_id in [approved_user_id, pending_user_id, closed_user_id]
+        ]
+        user_dicts = User.asdicts(session, users)
+        assert user_dicts == [user.asdict() for user in users]
+
+    assert [(u["can_buy"], u["can_sell"]) for u in user_dicts] == [
+        ("YES", "YES"),
+        ("NO", "UNAPPROVED"),
+        ("NO", "NO"),
+    ]
@@ -1,4 +1,20 @@
-from src.database import Base
+import asyncio
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from src.config import APP_CONFIG
+from src.database import (
+    AsyncService,
+    Base,
+    MeteredQueuePool,
+    pool_metrics,
+    pool_timeout,
+    run_after_commit,
+    session_scope,
+)
 from tests.utils import assert_dict_in
 
 
@@ -12,3 +28,116 @@ class DummyClass(Base):
 
 def test_asdict():
     assert_dict_in({"a": 2}, DummyClass().asdict())
+
+
+def test_async_service():
+    class DummyService:
+        config = {"a": 1}
+
+        def get(self, x, y=0):
+            return threading.current_thread(), x + y
+
+    service = AsyncService(DummyService())
+    thread, result = asyncio.run(service.get(1, y=2))
+
+    assert result == 3
+    assert thread != threading.current_thread()
+    assert service.config == {"a": 1}
+
+
+def test_session_scope__nested():
+    calls = []
+    with session_scope() as session:
+        with session_scope() as inner_session:
+            assert inner_session is session
+            run_after_commit(calls.append, 1)
+        assert calls == []
+    assert calls == [1]
+
+    with pytest.raises(ValueError):
+        with session_scope():
+            run_after_commit(calls.append, 2)
+            raise ValueError()
+    assert calls == [1]
+
+    with session_scope() as other_session:
+        assert other_session is not session
+    run_after_commit(calls.append, 3)
+    assert calls == [1, 3]
+
+
+def test_async_service__unit_of_work():
+    class DummyService:
+        def get(self):
+            with session_scope() as session, session_scope() as other_session:
+                pass
+            with session_scope() as last_session:
+                return session is other_session is last_session
+
+    assert asyncio.run(AsyncService(DummyService()).get())
+
+
+def test_async_service__pool_timeout():
+    class DummyService:
+        def get(self):
+            return pool_timeout.get()
+
+    assert (
+        asyncio.run(AsyncService(DummyService()).get())
+        == APP_CONFIG["DATABASE_POOL_TIMEOUT"]
+    )
+    assert pool_timeout.get() is None
+
+
+def test_metered_queue_pool(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'db.sqlite'}",
+        poolclass=MeteredQueuePool,
+        pool_size=1,
+        max_overflow=1,
+        pool_timeout=0.1,
+    )
+    pool_metrics.reset()
+
+    first = engine.connect()
+    second = engine.connect()
+    stats = pool_metrics.snapshot(engine.pool)
+    assert stats["checked_out"] == 2
+    assert stats["overflow"] == 1
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+
+    first.close()
+    second.close()
+    stats = pool_metrics.snapshot(engine.pool)
+    assert stats["checked_out"] == 0
+    assert stats["peak_checked_out"] == 2
+    assert stats["checkouts"] == 2
+    assert stats["timeouts"] == 1
+    assert stats["max_wait_time"] >= 0.1
+    assert sum(count for _, count in stats["hotspots"]) == 3
+
+
+def test_metered_queue_pool__pool_timeout(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'db.sqlite'}",
+        poolclass=MeteredQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=10,
+    )
+    connection = engine.connect()
+
+    token = pool_timeout.set(0.1)
+    try:
+        start = time.monotonic()
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        assert time.monotonic() - start < 1
+    finally:
+        pool_timeout.reset(token)
+
+    assert engine.pool._timeout == 10
+    assert engine.pool.recreate()._timeout == 10
+    connection.close()
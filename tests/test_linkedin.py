@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.config import APP_CONFIG
+from src.exceptions import UserProfileNotFoundException
+from src.linkedin import LinkedInClient
+
+RESPONSES = {
+    "/oauth/accessToken": {"access_token": "some_access_token"},
+    "/api/me": {
+        "id": "abcdef",
+        "firstName": {"localized": {"en_US": "Herbert"}},
+        "lastName": {"localized": {"en_US": "Tanujaya"}},
+        "profilePicture": {
+            "displayImage~": {
+                "elements": [{"identifiers": [{"identifier": "https://image"}]}]
+            }
+        },
+    },
+    "/api/emailAddress": {"elements": [{"handle~": {"emailAddress": "a@a.com"}}]},
+}
+
+
+class StubLinkedInHandler(BaseHTTPRequestHandler):
+    delay = 0
+
+    def _respond(self):
+        time.sleep(self.delay)
+        path = self.path.split("?")[0]
+        if self.headers.get("Authorization") == "Bearer expired_token":
+            status, body = 401, {}
+        elif self.headers.get("Authorization") == "Bearer throttled_token":
+            status, body = 429, {}
+        else:
+            status, body = 200, RESPONSES[path]
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def linkedin_client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLinkedInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield LinkedInClient(
+        {
+            **APP_CONFIG,
+            "LINKEDIN_OAUTH_URL": f"{url}/oauth",
+            "LINKEDIN_API_URL": f"{url}/api",
+            "LINKEDIN_TIMEOUT": 0.5,
+        }
+    )
+    StubLinkedInHandler.delay = 0
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_access_token(linkedin_client):
+    assert linkedin_client.get_access_token(
+        code="some_code",
+        redirect_uri="some_redirect_uri",
+        client_id="some_client_id",
+        client_secret="some_client_secret",
+    ) == {"access_token": "some_access_token"}
+
+
+def test_get_member_id(linkedin_client):
+    assert linkedin_client.get_member_id("some_token") == "abcdef"
+
+    with pytest.raises(UserProfileNotFoundException):
+        linkedin_client.get_member_id("expired_token")
+
+    with pytest.raises(UserProfileNotFoundException) as e:
+        linkedin_client.get_member_id("throttled_token")
+    assert e.value.status_code == 503
+
+
+def test_get_profile(linkedin_client):
+    StubLinkedInHandler.delay = 0.2
+    start = time.monotonic()
+    assert linkedin_client.get_profile("some_token") == {
+        "email": "a@a.com",
+        "full_name": "Herbert Tanujaya",
+        "display_image_url": "https://image",
+        "provider_user_id": "abcdef",
+    }
+    # the email address and the profile are fetched concurrently
+    assert time.monotonic() - start < 0.4
+
+    with pytest.raises(UserProfileNotFoundException):
+        linkedin_client.get_profile("expired_token")
+
+
+def test_start_get_profile(linkedin_client):
+    StubLinkedInHandler.delay = 0.2
+    start = time.monotonic()
+    get_profile = linkedin_client.start_get_profile("some_token")
+    assert linkedin_client.get_member_id("some_token") == "abcdef"
+    assert get_profile()["provider_user_id"] == "abcdef"
+    # the member id is fetched while the email address and the profile are
+    assert time.monotonic() - start < 0.4
+
+
+def test_timeout(linkedin_client):
+    StubLinkedInHandler.delay = 1
+    with pytest.raises(UserProfileNotFoundException) as e:
+        linkedin_client.get_member_id("some_token")
+    assert e.value.status_code == 503
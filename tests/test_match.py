@@ -1,6 +1,20 @@
+import random
+from copy import deepcopy
+
 import pytest
 
-from src.match import match_buyers_and_sellers
+from src.match import (
+    SOLVERS,
+    distribute_remaining_buyers,
+    generate_edges,
+    match_buyers_and_sellers,
+    match_buyers_and_sellers_by_security,
+    match_seller_with_nearest_buyer,
+    matching_quality,
+    record_phase,
+    solve_anytime,
+    solve_with_dense_assignment,
+)
 
 # fmt: off
 TRIVIAL_CASE = (
@@ -332,3 +346,397 @@ def test_match_buyers_and_sellers(
         match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches)
         == match_result
     )
+
+
+def random_order_book(seed, number_of_orders):
+    rng = random.Random(seed)
+    users = [f"u{i}" for i in range(number_of_orders // 2)]
+
+    def random_orders(prefix):
+        return [
+            {
+                "id": f"{prefix}{i}",
+                "user_id": rng.choice(users),
+                "number_of_shares": rng.randint(1, 10) * 10,
+                "price": rng.randint(5, 10),
+            }
+            for i in range(rng.randint(0, number_of_orders))
+        ]
+
+    buy_orders = random_orders("b")
+    sell_orders = random_orders("s")
+    banned_user_matches = {
+        (rng.choice(users), rng.choice(users)) for _ in range(number_of_orders // 4)
+    }
+    return buy_orders, sell_orders, banned_user_matches
+
+
+def pair_cost(
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    max_number_of_shares,
+    buy_order_id,
+    sell_order_id,
+):
+    cost = None
+    # Orders sharing an ID are the same node, the last feasible pair wins
+    for buy_order in buy_orders:
+        for sell_order in sell_orders:
+            if (
+                buy_order["id"] == buy_order_id
+                and sell_order["id"] == sell_order_id
+                and buy_order["price"] >= sell_order["price"]
+                and (buy_order["user_id"], sell_order["user_id"])
+                not in banned_user_matches
+            ):
+                cost = abs(
+                    buy_order["price"] - sell_order["price"]
+                ) * max_number_of_shares * 2 + abs(
+                    buy_order["number_of_shares"] - sell_order["number_of_shares"]
+                )
+    return cost
+
+
+def matching_objective(
+    buy_orders, sell_orders, banned_user_matches, matching, max_number_of_shares
+):
+    cost = 0
+    for buy_order_id, sell_order_id in matching:
+        c = pair_cost(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            max_number_of_shares,
+            buy_order_id,
+            sell_order_id,
+        )
+        assert c is not None
+        cost += c
+    return len(matching), cost
+
+
+@pytest.mark.parametrize("edge_chunk_size", [1, 7, 2 ** 20])
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches",
+    [case[:3] for case in TEST_CASES]
+    + [random_order_book(seed, 30) for seed in range(5)],
+)
+def test_generate_edges(
+    buy_orders, sell_orders, banned_user_matches, edge_chunk_size, monkeypatch
+):
+    monkeypatch.setattr("src.match.EDGE_CHUNK_SIZE", edge_chunk_size)
+    buy_order_ids, sell_order_ids, rows, cols, costs = generate_edges(
+        buy_orders, sell_orders, banned_user_matches, 100
+    )
+
+    assert buy_order_ids == list(dict.fromkeys(o["id"] for o in buy_orders))
+    assert sell_order_ids == list(dict.fromkeys(o["id"] for o in sell_orders))
+    edges = {
+        (buy_order_ids[i], sell_order_ids[j]): cost
+        for i, j, cost in zip(rows, cols, costs)
+    }
+    assert len(edges) == len(costs)
+    for buy_order_id in buy_order_ids:
+        for sell_order_id in sell_order_ids:
+            assert edges.get((buy_order_id, sell_order_id)) == pair_cost(
+                buy_orders,
+                sell_orders,
+                banned_user_matches,
+                100,
+                buy_order_id,
+                sell_order_id,
+            )
+
+
+@pytest.mark.parametrize("edge_chunk_size", [1, 7, 2 ** 20])
+@pytest.mark.parametrize("max_edges_per_order", [1, 3])
+@pytest.mark.parametrize("seed", range(5))
+def test_generate_edges__max_edges_per_order(
+    seed, max_edges_per_order, edge_chunk_size, monkeypatch
+):
+    buy_orders, sell_orders, banned_user_matches = random_order_book(seed, 30)
+    _, _, all_rows, all_cols, all_costs = generate_edges(
+        buy_orders, sell_orders, banned_user_matches, 100
+    )
+
+    monkeypatch.setattr("src.match.EDGE_CHUNK_SIZE", edge_chunk_size)
+    _, _, rows, cols, costs = generate_edges(
+        buy_orders,
+        sell_orders,
+        banned_user_matches,
+        100,
+        max_edges_per_order=max_edges_per_order,
+    )
+
+    def cheapest_costs(rows, cols, costs):
+        costs_by_node = {}
+        for i, j, cost in zip(rows, cols, costs):
+            costs_by_node.setdefault(("buy", i), []).append(cost)
+            costs_by_node.setdefault(("sell", j), []).append(cost)
+        return {
+            node: sorted(node_costs)[:max_edges_per_order]
+            for node, node_costs in costs_by_node.items()
+        }
+
+    all_edges = {(i, j): cost for i, j, cost in zip(all_rows, all_cols, all_costs)}
+    expected = cheapest_costs(all_rows, all_cols, all_costs)
+    for i, j, cost in zip(rows, cols, costs):
+        assert all_edges[(i, j)] == cost
+        assert cost <= max(expected[("buy", i)]) or cost <= max(expected[("sell", j)])
+    # Every order keeps its cheapest edges, up to ties between edges of the same cost
+    assert cheapest_costs(rows, cols, costs) == expected
+
+
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches",
+    [case[:3] for case in TEST_CASES]
+    + [random_order_book(seed, 30) for seed in range(20)],
+)
+def test_match_seller_with_nearest_buyer__solvers_have_same_objective(
+    buy_orders, sell_orders, banned_user_matches
+):
+    max_number_of_shares = max(
+        [o["number_of_shares"] for o in buy_orders + sell_orders], default=0
+    )
+
+    objectives = set()
+    # solve_anytime is not always optimal, see test_solve_anytime__quality
+    for solver in ["networkx", "dense_assignment"]:
+        matching = match_seller_with_nearest_buyer(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            max_number_of_shares,
+            solver=solver,
+        )
+        assert len({b for b, _ in matching}) == len(matching)
+        assert len({s for _, s in matching}) == len(matching)
+        for buy_order_id, sell_order_id in matching:
+            buy_user_id = next(o for o in buy_orders if o["id"] == buy_order_id)[
+                "user_id"
+            ]
+            sell_user_id = next(o for o in sell_orders if o["id"] == sell_order_id)[
+                "user_id"
+            ]
+            assert (buy_user_id, sell_user_id) not in banned_user_matches
+
+        objectives.add(
+            matching_objective(
+                buy_orders,
+                sell_orders,
+                banned_user_matches,
+                matching,
+                max_number_of_shares,
+            )
+        )
+
+    assert len(objectives) == 1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_match_seller_with_nearest_buyer__max_edges_per_order(seed):
+    buy_orders, sell_orders, banned_user_matches = random_order_book(seed, 30)
+
+    assert match_seller_with_nearest_buyer(
+        buy_orders,
+        sell_orders,
+        banned_user_matches,
+        100,
+        max_edges_per_order=len(buy_orders) + len(sell_orders),
+    ) == match_seller_with_nearest_buyer(
+        buy_orders, sell_orders, banned_user_matches, 100
+    )
+
+
+def distribute_remaining_buyers_by_scanning(
+    buy_orders, sell_orders, banned_user_matches
+):
+    """
+    The original quadratic implementation of distribute_remaining_buyers.
+    """
+
+    def cmp(sell_order, buy_order):
+        return (
+            -buy_order["price"],
+            abs(sell_order["number_of_shares"] - buy_order["number_of_shares"]),
+        )
+
+    result = set()
+    sorted_sell_orders = sorted(
+        sell_orders, key=lambda o: (o["price"], -o["number_of_shares"])
+    )
+    while len(sorted_sell_orders) > 0:
+        unmatched_sell_orders = []
+        for sell_order in sorted_sell_orders:
+            eligible_buy_orders = [
+                buy_order
+                for buy_order in buy_orders
+                if (buy_order["price"] >= sell_order["price"])
+                and (
+                    (buy_order["user_id"], sell_order["user_id"])
+                    not in banned_user_matches
+                )
+            ]
+            if len(eligible_buy_orders) == 0:
+                unmatched_sell_orders.append(sell_order)
+                continue
+            buy_order = min(eligible_buy_orders, key=lambda o: cmp(sell_order, o))
+            result.add((buy_order["id"], sell_order["id"]))
+            buy_orders.remove(buy_order)
+        for sell_order in unmatched_sell_orders:
+            sorted_sell_orders.remove(sell_order)
+    return result
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_distribute_remaining_buyers(seed):
+    buy_orders, sell_orders, banned_user_matches = random_order_book(seed, 40)
+    # Doubled sell orders, as the matching service passes them in
+    sell_orders = sell_orders + sell_orders[: len(sell_orders) // 2]
+    expected_buy_orders = list(buy_orders)
+
+    expected = distribute_remaining_buyers_by_scanning(
+        expected_buy_orders, sell_orders, banned_user_matches
+    )
+    assert (
+        distribute_remaining_buyers(buy_orders, sell_orders, banned_user_matches)
+        == expected
+    )
+    assert buy_orders == expected_buy_orders
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_match_buyers_and_sellers_by_security(max_workers):
+    books = {
+        security_id: random_order_book(seed, 20)
+        for seed, security_id in enumerate(["A", "B", "C"])
+    }
+    buy_orders = []
+    sell_orders = []
+    banned_user_matches = set()
+    for (
+        security_id,
+        (security_buy_orders, security_sell_orders, banned),
+    ) in books.items():
+        for o in security_buy_orders + security_sell_orders:
+            o["id"] = security_id + o["id"]
+            o["security_id"] = security_id
+        buy_orders += security_buy_orders
+        sell_orders += security_sell_orders
+        banned_user_matches |= banned
+
+    expected = set()
+    for security_buy_orders, security_sell_orders, _ in books.values():
+        if len(security_buy_orders) > 0 and len(security_sell_orders) > 0:
+            expected |= match_buyers_and_sellers(
+                security_buy_orders,
+                security_sell_orders,
+                banned_user_matches,
+                solver="dense_assignment",
+            )
+
+    assert (
+        match_buyers_and_sellers_by_security(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            max_workers=max_workers,
+            solver="dense_assignment",
+        )
+        == expected
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_match_buyers_and_sellers__does_not_mutate_orders(seed):
+    buy_orders, sell_orders, banned_user_matches = random_order_book(seed, 30)
+    sell_orders = sell_orders + sell_orders[: len(sell_orders) // 2]
+    if len(buy_orders + sell_orders) == 0:
+        return
+    expected_buy_orders = deepcopy(buy_orders)
+    expected_sell_orders = deepcopy(sell_orders)
+
+    match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches)
+
+    assert buy_orders == expected_buy_orders
+    assert sell_orders == expected_sell_orders
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_solve_anytime__time_budget(seed):
+    buy_orders, sell_orders, banned_user_matches = random_order_book(seed, 30)
+    _, _, rows, cols, costs = generate_edges(
+        buy_orders, sell_orders, banned_user_matches, 100
+    )
+    edges = set(zip(rows.tolist(), cols.tolist()))
+
+    matching = solve_anytime(rows, cols, costs, time_budget=0)
+
+    assert matching <= edges
+    assert len({i for i, _ in matching}) == len(matching)
+    assert len({j for _, j in matching}) == len(matching)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_solve_anytime__quality(seed):
+    buy_orders, sell_orders, banned_user_matches = random_order_book(seed, 30)
+    _, _, rows, cols, costs = generate_edges(
+        buy_orders, sell_orders, banned_user_matches, 100
+    )
+    edges = set(zip(rows.tolist(), cols.tolist()))
+    optimum = matching_quality(
+        rows, cols, costs, solve_with_dense_assignment(rows, cols, costs)
+    )
+
+    matching = solve_anytime(rows, cols, costs)
+    quality = matching_quality(rows, cols, costs, matching)
+
+    assert matching <= edges
+    assert len({i for i, _ in matching}) == len(matching)
+    assert len({j for _, j in matching}) == len(matching)
+    assert quality["matches"] == optimum["matches"]
+    assert quality["cost"] >= optimum["cost"]
+
+
+@pytest.mark.parametrize("solver", sorted(SOLVERS))
+@pytest.mark.parametrize("seed", range(10))
+def test_matching_quality(seed, solver):
+    buy_orders, sell_orders, banned_user_matches = random_order_book(seed, 30)
+    _, _, rows, cols, costs = generate_edges(
+        buy_orders, sell_orders, banned_user_matches, 100
+    )
+    optimum = matching_quality(
+        rows, cols, costs, solve_with_dense_assignment(rows, cols, costs)
+    )
+
+    quality = matching_quality(rows, cols, costs, SOLVERS[solver](rows, cols, costs))
+
+    assert quality["matches"] == optimum["matches"] <= quality["max_matches"]
+    assert quality["cost"] >= optimum["cost"] >= quality["cost_lower_bound"]
+
+
+def test_match_buyers_and_sellers_by_security__stats():
+    buy_orders, sell_orders, banned_user_matches = random_order_book(0, 30)
+    for o in buy_orders + sell_orders:
+        o["security_id"] = "security"
+
+    stats = {}
+    matches = match_buyers_and_sellers_by_security(
+        buy_orders, sell_orders, banned_user_matches, stats=stats, solver="anytime"
+    )
+
+    assert list(stats) == ["security"]
+    assert stats["security"]["first_matching"]["matches"] <= len(matches)
+
+
+def test_record_phase__raises():
+    stats = {}
+    with pytest.raises(ValueError):
+        with record_phase(stats, "phase") as record:
+            record["counter"] = 1
+            raise ValueError
+
+    assert stats["phase"]["counter"] == 1
+    assert stats["phase"]["wall_time"] >= 0
+    assert stats["phase"]["max_rss"] > 0
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+
+from src.scheduler import add_progress_listener, progress_listeners, report_progress
+
+
+def test_report_progress():
+    calls = []
+    add_progress_listener(lambda *args: calls.append(args))
+
+    try:
+        report_progress("job", "started", round_id="1")
+    finally:
+        progress_listeners.clear()
+
+    assert calls == [("job", "started", {"round_id": "1"})]
+
+
+def test_report_progress__on_loop():
+    loop = asyncio.new_event_loop()
+    calls = []
+    add_progress_listener(
+        lambda *args: calls.append((threading.current_thread(), args)), loop=loop
+    )
+
+    try:
+        thread = threading.Thread(target=report_progress, args=("job", "finished"))
+        thread.start()
+        thread.join()
+        assert calls == []
+
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        progress_listeners.clear()
+        loop.close()
+
+    assert calls == [(threading.main_thread(), ("job", "finished", {}))]
@@ -0,0 +1,32 @@
+from unittest.mock import patch
+
+import pytest
+
+from src.exceptions import InvalidAuthorizationTokenException
+from src.sessions import issue_session_token, verify_session_token
+
+USER = {"id": "1", "can_buy": "YES", "can_sell": "NO", "is_committee": False}
+
+
+def test_verify_session_token():
+    token = issue_session_token(USER, secret="secret", lifetime=60)
+
+    session = verify_session_token(token, secret="secret")
+    assert {key: session[key] for key in USER} == USER
+
+    with pytest.raises(InvalidAuthorizationTokenException):
+        verify_session_token(token, secret="other_secret")
+    with pytest.raises(InvalidAuthorizationTokenException):
+        verify_session_token(token + "x", secret="secret")
+    with pytest.raises(InvalidAuthorizationTokenException):
+        verify_session_token(None, secret="secret")
+
+
+def test_verify_session_token__expired():
+    with patch("src.sessions.time.time", return_value=0):
+        token = issue_session_token(USER, secret="secret", lifetime=60)
+        verify_session_token(token, secret="secret")
+
+    with patch("src.sessions.time.time", return_value=60):
+        with pytest.raises(InvalidAuthorizationTokenException):
+            verify_session_token(token, secret="secret")
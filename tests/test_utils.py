@@ -0,0 +1,57 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+
+from src.exceptions import InvalidRequestException
+from src.utils import CachedValue, TtlCache, decode_cursor, encode_cursor
+
+
+def test_ttl_cache():
+    cache = TtlCache(ttl=10, maxsize=2)
+
+    with patch("src.utils.time.monotonic", return_value=0):
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        # "b" is the least recently used
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+        cache.discard_if(lambda value: value == 3)
+        assert cache.get("c") is None
+
+    with patch("src.utils.time.monotonic", return_value=10):
+        assert cache.get("a") is None
+
+
+def test_cached_value():
+    cached_value = CachedValue()
+    assert cached_value.get() == (False, None, 0)
+
+    with patch("src.utils.time.time", return_value=0):
+        cached_value.set(None, expires_at=10, generation=0)
+        assert cached_value.get() == (True, None, 0)
+
+    with patch("src.utils.time.time", return_value=10):
+        assert cached_value.get() == (False, None, 0)
+
+        # a value loaded before a clear is not cached
+        _, _, generation = cached_value.get()
+        cached_value.clear()
+        cached_value.set(1, expires_at=20, generation=generation)
+        assert cached_value.get() == (False, None, 1)
+
+        cached_value.set(1, expires_at=20, generation=1)
+        assert cached_value.get() == (True, 1, 1)
+
+
+def test_cursor():
+    created_at = datetime(2020, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc)
+    id = "5b8f5e1c-2a3b-4c5d-8e9f-0a1b2c3d4e5f"
+    assert decode_cursor(encode_cursor(created_at, id)) == (created_at, id)
+
+    for cursor in ["", "abc", encode_cursor(created_at, id)[:-4], "w6k="]:
+        with pytest.raises(InvalidRequestException):
+            decode_cursor(cursor)
@@ -1,3 +1,25 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from src.database import engine
+
+
 def assert_dict_in(inside, outside):
     for k, v in inside.items():
         assert v == outside[k]
+
+
+@contextmanager
+def captured_queries():
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().upper().startswith("SELECT"):
+            queries.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)